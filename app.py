@@ -1,24 +1,163 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, make_response, stream_with_context
 import json
+import itertools
 import os
+import time
+from functools import lru_cache
+import orjson
+from sqlalchemy import event, func, insert, select, true
+from sqlalchemy.orm import load_only, raiseload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Challenge, Submission, TestCase, SolutionTemplate
+from models import db, User, Challenge, Submission, TestCase, SolutionTemplate, ChallengeRequiredBlock
+from json_provider import OrjsonProvider
+from submission_writer import SubmissionWriter, save_submission
+from required_blocks import parse_required_blocks
 
 print('[boot] app_file:', os.path.abspath(__file__))
 
+# scrypt is implemented in C (hashlib); check_password_hash detects the scheme from the stored prefix
+PASSWORD_HASH_METHOD = 'scrypt'
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
-# Disable caching in development to avoid stale JS/CSS
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# Let browsers cache static files in production (disabled again in the dev runner below)
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 3600
 
 # SQLite config
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Keep warm connections across requests instead of reopening the DB file each time
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 3600,
+    'connect_args': {'check_same_thread': False, 'timeout': 5}
+}
 db.init_app(app)
 
+
+# WAL lets readers proceed while a write is in progress; NORMAL sync is safe under WAL
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.close()
+
+
+# Sample challenges seeded on first boot
+_SAMPLE_CHALLENGES = [
+    {
+        'title': 'التحدي 1: اطبع Hello خمس مرات',
+        'description': 'اطبع كلمة Hello خمس مرات باستخدام حلقة while وعدّاد.',
+        'required_blocks': ['init_variable', 'while_loop', 'print_text', 'increment'],
+        'concept': 'loop',
+        'difficulty': 'easy'
+    },
+    {
+        'title': 'التحدي 2: عدّ من 1 إلى 5',
+        'description': 'اكتب برنامجًا يطبع الأعداد من 1 إلى 5 باستخدام while.',
+        'required_blocks': ['init_variable', 'while_loop', 'print_text', 'increment', 'compare'],
+        'concept': 'loop',
+        'difficulty': 'easy'
+    },
+    {
+        'title': 'التحدي 3: إذا كان العدد أكبر من 10',
+        'description': 'إذا كان العدد أكبر من 10 اطبع "Big" وإلا اطبع "Small".',
+        'required_blocks': ['init_variable', 'if_condition', 'compare', 'print_text'],
+        'concept': 'condition',
+        'difficulty': 'easy'
+    },
+    {
+        'title': 'التحدي 4: اطبع مجموع عددين',
+        'description': 'احسب مجموع عددين ثم اطبع الناتج.',
+        'required_blocks': ['init_variable', 'add_subtract', 'print_text', 'number_value'],
+        'concept': 'math',
+        'difficulty': 'easy'
+    },
+    {
+        'title': 'التحدي 5: اطبع كلمة مكررة',
+        'description': 'اطبع كلمة "Hi" ثلاث مرات باستخدام while.',
+        'required_blocks': ['init_variable', 'while_loop', 'print_text', 'increment', 'text_value'],
+        'concept': 'loop',
+        'difficulty': 'easy'
+    },
+    {
+        'title': 'التحدي 6: هل العدد زوجي؟',
+        'description': 'تحقق إن كان العدد زوجيًا (باقي القسمة على 2 يساوي 0) ثم اطبع النتيجة.',
+        'required_blocks': ['init_variable', 'if_condition', 'compare', 'add_subtract', 'print_text', 'number_value'],
+        'concept': 'condition',
+        'difficulty': 'medium'
+    },
+    {
+        'title': 'التحدي 7: أنشئ قائمة واطبع طولها',
+        'description': 'أنشئ قائمة فيها 3 عناصر ثم اطبع طول القائمة.',
+        'required_blocks': ['list_create', 'list_length', 'print_text'],
+        'concept': 'lists',
+        'difficulty': 'medium'
+    },
+    {
+        'title': 'التحدي 8: اطبع أول عنصر من قائمة',
+        'description': 'أنشئ قائمة ثم اطبع أول عنصر فيها.',
+        'required_blocks': ['list_create', 'list_get', 'print_text'],
+        'concept': 'lists',
+        'difficulty': 'medium'
+    },
+    {
+        'title': 'التحدي 9: غيّر قيمة متغير',
+        'description': 'أنشئ متغيرًا بقيمة 0 ثم زِده بمقدار 1 مرتين ثم اطبع القيمة النهائية.',
+        'required_blocks': ['init_variable', 'increment', 'print_text', 'number_value'],
+        'concept': 'variables',
+        'difficulty': 'medium'
+    },
+    {
+        'title': 'التحدي 10: عدّ تنازليًا',
+        'description': 'اطبع الأعداد من 5 إلى 1 باستخدام while (تنازلي).',
+        'required_blocks': ['init_variable', 'while_loop', 'print_text', 'add_subtract', 'compare', 'number_value'],
+        'concept': 'loop',
+        'difficulty': 'hard'
+    }
+]
+
+# Ready-to-insert rows, built once at import (required_blocks already JSON-encoded)
+_SAMPLE_ROWS = tuple(
+    {
+        'title': s['title'],
+        'description': s['description'],
+        'required_blocks': orjson.dumps(s['required_blocks']).decode(),
+        'concept': s.get('concept'),
+        'difficulty': s.get('difficulty'),
+        'json_template': '{}'
+    } for s in _SAMPLE_CHALLENGES
+)
+_SAMPLE_BLOCKS = {s['title']: s['required_blocks'] for s in _SAMPLE_CHALLENGES}
+
+
+# =====================================================
+# Required blocks helpers
+# =====================================================
+def store_required_blocks(challenge_id, required_blocks):
+    """Write the parsed required blocks of a challenge to ChallengeRequiredBlock."""
+    names = parse_required_blocks(required_blocks)
+    if names:
+        db.session.execute(insert(ChallengeRequiredBlock), [
+            {'challenge_id': challenge_id, 'position': i, 'block_name': n} for i, n in enumerate(names)
+        ])
+
+
 # Create database if not exists
 with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', _set_sqlite_pragmas)
     db.create_all()
+    # create_all() skips indexes on tables that already exist
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
 
     try:
         uri = app.config.get('SQLALCHEMY_DATABASE_URI')
@@ -29,121 +168,84 @@ with app.app_context():
         print('[seed] db_uri:', uri)
         print('[seed] db_path:', db_abs_path if db_abs_path else '(non-sqlite-or-unknown)')
 
-        before_count = Challenge.query.count()
-        print('[seed] before:', before_count)
-        samples = [
-                {
-                    'title': 'التحدي 1: اطبع Hello خمس مرات',
-                    'description': 'اطبع كلمة Hello خمس مرات باستخدام حلقة while وعدّاد.',
-                    'required_blocks': ['init_variable', 'while_loop', 'print_text', 'increment'],
-                    'concept': 'loop',
-                    'difficulty': 'easy'
-                },
-                {
-                    'title': 'التحدي 2: عدّ من 1 إلى 5',
-                    'description': 'اكتب برنامجًا يطبع الأعداد من 1 إلى 5 باستخدام while.',
-                    'required_blocks': ['init_variable', 'while_loop', 'print_text', 'increment', 'compare'],
-                    'concept': 'loop',
-                    'difficulty': 'easy'
-                },
-                {
-                    'title': 'التحدي 3: إذا كان العدد أكبر من 10',
-                    'description': 'إذا كان العدد أكبر من 10 اطبع "Big" وإلا اطبع "Small".',
-                    'required_blocks': ['init_variable', 'if_condition', 'compare', 'print_text'],
-                    'concept': 'condition',
-                    'difficulty': 'easy'
-                },
-                {
-                    'title': 'التحدي 4: اطبع مجموع عددين',
-                    'description': 'احسب مجموع عددين ثم اطبع الناتج.',
-                    'required_blocks': ['init_variable', 'add_subtract', 'print_text', 'number_value'],
-                    'concept': 'math',
-                    'difficulty': 'easy'
-                },
-                {
-                    'title': 'التحدي 5: اطبع كلمة مكررة',
-                    'description': 'اطبع كلمة "Hi" ثلاث مرات باستخدام while.',
-                    'required_blocks': ['init_variable', 'while_loop', 'print_text', 'increment', 'text_value'],
-                    'concept': 'loop',
-                    'difficulty': 'easy'
-                },
-                {
-                    'title': 'التحدي 6: هل العدد زوجي؟',
-                    'description': 'تحقق إن كان العدد زوجيًا (باقي القسمة على 2 يساوي 0) ثم اطبع النتيجة.',
-                    'required_blocks': ['init_variable', 'if_condition', 'compare', 'add_subtract', 'print_text', 'number_value'],
-                    'concept': 'condition',
-                    'difficulty': 'medium'
-                },
-                {
-                    'title': 'التحدي 7: أنشئ قائمة واطبع طولها',
-                    'description': 'أنشئ قائمة فيها 3 عناصر ثم اطبع طول القائمة.',
-                    'required_blocks': ['list_create', 'list_length', 'print_text'],
-                    'concept': 'lists',
-                    'difficulty': 'medium'
-                },
-                {
-                    'title': 'التحدي 8: اطبع أول عنصر من قائمة',
-                    'description': 'أنشئ قائمة ثم اطبع أول عنصر فيها.',
-                    'required_blocks': ['list_create', 'list_get', 'print_text'],
-                    'concept': 'lists',
-                    'difficulty': 'medium'
-                },
-                {
-                    'title': 'التحدي 9: غيّر قيمة متغير',
-                    'description': 'أنشئ متغيرًا بقيمة 0 ثم زِده بمقدار 1 مرتين ثم اطبع القيمة النهائية.',
-                    'required_blocks': ['init_variable', 'increment', 'print_text', 'number_value'],
-                    'concept': 'variables',
-                    'difficulty': 'medium'
-                },
-                {
-                    'title': 'التحدي 10: عدّ تنازليًا',
-                    'description': 'اطبع الأعداد من 5 إلى 1 باستخدام while (تنازلي).',
-                    'required_blocks': ['init_variable', 'while_loop', 'print_text', 'add_subtract', 'compare', 'number_value'],
-                    'concept': 'loop',
-                    'difficulty': 'hard'
-                }
-            ]
-
-        added = 0
-        for s in samples:
-            exists = Challenge.query.filter_by(title=s['title']).first()
-            if exists:
-                continue
-            db.session.add(Challenge(
-                title=s['title'],
-                description=s['description'],
-                required_blocks=json.dumps(s['required_blocks'], ensure_ascii=False),
-                concept=s.get('concept'),
-                difficulty=s.get('difficulty'),
-                json_template='{}'
-            ))
-            added += 1
-        if added:
-            db.session.commit()
-        after_count = Challenge.query.count()
+        # Row counts cost two SELECT count(*) per boot, so only log them on request
+        seed_verbose = app.debug or bool(os.environ.get('SEED_VERBOSE'))
+
+        # One transaction for the whole seed: begin() commits on exit and rolls back on error
+        with db.session.begin(), db.session.no_autoflush:
+            if seed_verbose:
+                before_count = Challenge.query.count()
+                print('[seed] before:', before_count)
+
+            # Single IN (...) lookup instead of one SELECT per sample
+            titles = [r['title'] for r in _SAMPLE_ROWS]
+            existing = {t for (t,) in db.session.query(Challenge.title).filter(Challenge.title.in_(titles)).all()}
+
+            rows = [r for r in _SAMPLE_ROWS if r['title'] not in existing]
+            added = len(rows)
+            if rows:
+                db.session.bulk_insert_mappings(Challenge, rows)
+                new_ids = db.session.query(Challenge.id, Challenge.title).filter(
+                    Challenge.title.in_([r['title'] for r in rows])
+                ).all()
+                db.session.execute(insert(ChallengeRequiredBlock), [
+                    {'challenge_id': cid, 'position': i, 'block_name': b}
+                    for cid, title in new_ids for i, b in enumerate(_SAMPLE_BLOCKS[title])
+                ])
+
+            # One-time backfill for challenges saved before ChallengeRequiredBlock existed
+            unparsed = db.session.execute(
+                select(Challenge.id, Challenge.required_blocks).where(
+                    ~select(ChallengeRequiredBlock.challenge_id)
+                    .where(ChallengeRequiredBlock.challenge_id == Challenge.id).exists()
+                )
+            ).all()
+            for cid, required_blocks in unparsed:
+                store_required_blocks(cid, required_blocks)
         print('[seed] added:', added)
-        print('[seed] after:', after_count)
+        if seed_verbose:
+            print('[seed] after:', before_count + added)
     except Exception:
         print('[seed] FAILED')
         import traceback
         traceback.print_exc()
-        db.session.rollback()
+
+
+_NO_CACHE_HEADERS = (
+    ('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0'),
+    ('Pragma', 'no-cache'),
+    ('Expires', '0')
+)
 
 
 @app.after_request
 def add_no_cache_headers(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
+    # Only in development, to avoid stale JS/CSS while editing
+    if app.debug:
+        # update() replaces existing values (e.g. send_file's Cache-Control) in one call
+        response.headers.update(_NO_CACHE_HEADERS)
     return response
 
 
+# The UI pages take no template context, so their HTML never changes between requests
+@lru_cache(maxsize=16)
+def _render_static_cached(name):
+    return render_template(name)
+
+
+def _render_static(name):
+    # Skip the cache in debug so template edits show up on reload
+    if app.debug:
+        return render_template(name)
+    return _render_static_cached(name)
+
+
 # =====================================================
 # Home Route
 # =====================================================
 @app.route('/')
 def home():
-    return render_template('index.html')
+    return _render_static('index.html')
 
 
 @app.route('/api')
@@ -153,47 +255,56 @@ def api_home():
 
 @app.route('/login', methods=['GET'])
 def login_page():
-    return render_template('login.html')
+    return _render_static('login.html')
 
 
 @app.route('/register', methods=['GET'])
 def register_page():
-    return render_template('register.html')
+    return _render_static('register.html')
 
 
 @app.route('/challenges_ui', methods=['GET'])
 def challenges_page():
-    return render_template('challenges.html')
+    return _render_static('challenges.html')
 
 
 @app.route('/challenge', methods=['GET'])
 def challenge_page():
-    return render_template('challenge.html')
+    return _render_static('challenge.html')
 
 
 @app.route('/teacher', methods=['GET'])
 def teacher_page():
-    return render_template('teacher.html')
+    return _render_static('teacher.html')
 
 
 @app.route('/blockly-demo', methods=['GET'])
 def blockly_demo_page():
-    return render_template('blockly_demo.html')
+    return _render_static('blockly_demo.html')
 
 
 @app.route('/blockly-demo/', methods=['GET'])
 def blockly_demo_page_slash():
-    return render_template('blockly_demo.html')
+    return _render_static('blockly_demo.html')
+
+
+# Routes are all registered at import time, so the listing is built once
+_ROUTES_CACHE = None
 
 
 @app.route('/_routes', methods=['GET'])
 def list_routes():
-    rules = []
-    for rule in app.url_map.iter_rules():
-        methods = sorted([m for m in rule.methods if m not in ('HEAD', 'OPTIONS')])
-        rules.append({'rule': str(rule), 'endpoint': rule.endpoint, 'methods': methods})
-    rules.sort(key=lambda r: r['rule'])
-    return jsonify(rules)
+    global _ROUTES_CACHE
+    if _ROUTES_CACHE is None:
+        rules = []
+        for rule in app.url_map.iter_rules():
+            methods = sorted([m for m in rule.methods if m not in ('HEAD', 'OPTIONS')])
+            rules.append({'rule': str(rule), 'endpoint': rule.endpoint, 'methods': methods})
+        rules.sort(key=lambda r: r['rule'])
+        _ROUTES_CACHE = jsonify(rules).get_data()
+    resp = make_response(_ROUTES_CACHE)
+    resp.mimetype = 'application/json'
+    return resp
 
 
 @app.route('/_whoami', methods=['GET'])
@@ -217,10 +328,10 @@ def register():
     if not username or not password:
         return jsonify({'error': 'Username and password required'}), 400
 
-    if User.query.filter_by(username=username).first():
+    if db.session.query(User.id).filter_by(username=username).first() is not None:
         return jsonify({'error': 'Username already exists'}), 409
 
-    hashed_password = generate_password_hash(password)
+    hashed_password = generate_password_hash(password, method=PASSWORD_HASH_METHOD, salt_length=16)
     new_user = User(username=username, password=hashed_password, role=role)
     db.session.add(new_user)
     db.session.commit()
@@ -237,11 +348,19 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    user = User.query.filter_by(username=username).first()
+    # Only the columns we need; avoids building a full User instance
+    user = db.session.query(User.id, User.password, User.role).filter_by(username=username).first()
 
     if not user or not check_password_hash(user.password, password):
         return jsonify({'error': 'Invalid username or password'}), 401
 
+    # Lazily upgrade hashes created with the old PBKDF2 default
+    if not user.password.startswith(PASSWORD_HASH_METHOD + ':'):
+        db.session.query(User).filter_by(id=user.id).update({
+            'password': generate_password_hash(password, method=PASSWORD_HASH_METHOD, salt_length=16)
+        })
+        db.session.commit()
+
     return jsonify({'message': f'Welcome back, {username}!', 'role': user.role}), 200
 
 
@@ -250,13 +369,28 @@ def login():
 # =====================================================
 @app.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([{'id': u.id, 'username': u.username, 'role': u.role} for u in users])
+    q = db.session.query(User.id, User.username, User.role).yield_per(200)
+    return stream_json_array({'id': u.id, 'username': u.username, 'role': u.role} for u in q)
+
+
+def stream_json_array(items):
+    """Stream an iterable of dicts as a JSON array, one element at a time."""
+    dumps, option, default = orjson.dumps, app.json.option, app.json.default
+
+    def gen():
+        yield b'['
+        for i, item in enumerate(items):
+            yield (b',' if i else b'') + dumps(item, default=default, option=option)
+        yield b']\n'
+    return Response(stream_with_context(gen()), mimetype='application/json')
 
 
 # =====================================================
 # Helper function: Check role manually (simple version)
 # =====================================================
+_TEACHER_ROLES = frozenset({'teacher'})
+
+
 def check_role(user_role, allowed_roles):
     if user_role not in allowed_roles and user_role != 'admin':
         return False
@@ -269,7 +403,8 @@ def get_user_from_payload(data):
         username = data.get('username')
     if not username:
         return None
-    return User.query.filter_by(username=username).first()
+    # Lightweight row (id, username, role) - callers only read these columns
+    return db.session.query(User.id, User.username, User.role).filter_by(username=username).first()
 
 
 # =====================================================
@@ -302,24 +437,46 @@ def add_challenge():
         json_template=json_template
     )
     db.session.add(new_challenge)
+    db.session.flush()
+    store_required_blocks(new_challenge.id, required_blocks)
     db.session.commit()
+    invalidate_challenges_cache()
 
     return jsonify({'message': f'Challenge "{title}" added successfully!'}), 201
 
 # =====================================================
 # 5️⃣ Get All Challenges
 # =====================================================
+# The list only changes when a teacher edits challenges; cache the serialized body
+# for a short time and clear it from every endpoint that modifies challenges.
+_CHALLENGES_CACHE_TTL = 60
+_challenges_cache = {}  # 'all' -> (expires_at, body bytes)
+
+
+def invalidate_challenges_cache():
+    _challenges_cache.clear()
+
+
 @app.route('/challenges', methods=['GET'])
 def get_challenges():
-    challenges = Challenge.query.all()
-    return jsonify([
-        {
-            'id': c.id,
-            'title': c.title,
-            'concept': c.concept,
-            'difficulty': c.difficulty
-        } for c in challenges
-    ])
+    cached = _challenges_cache.get('all')
+    if cached and cached[0] > time.monotonic():
+        body = cached[1]
+    else:
+        challenges = Challenge.query.options(raiseload('*')).all()
+        body = jsonify([
+            {
+                'id': c.id,
+                'title': c.title,
+                'concept': c.concept,
+                'difficulty': c.difficulty
+            } for c in challenges
+        ]).get_data()
+        _challenges_cache['all'] = (time.monotonic() + _CHALLENGES_CACHE_TTL, body)
+
+    resp = make_response(body)
+    resp.mimetype = 'application/json'
+    return resp
 
 
 # =====================================================
@@ -327,7 +484,7 @@ def get_challenges():
 # =====================================================
 @app.route('/challenges/<int:challenge_id>', methods=['GET'])
 def get_challenge(challenge_id):
-    c = Challenge.query.get_or_404(challenge_id)
+    c = Challenge.query.options(raiseload('*')).get_or_404(challenge_id)
     return jsonify({
         'id': c.id,
         'title': c.title,
@@ -346,12 +503,12 @@ def get_challenge(challenge_id):
 def update_challenge(challenge_id):
     data = request.get_json()
     username = data.get('username')
-    user = User.query.filter_by(username=username).first()
+    user = db.session.query(User.role).filter_by(username=username).first()
 
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     c = Challenge.query.get_or_404(challenge_id)
@@ -360,6 +517,7 @@ def update_challenge(challenge_id):
     c.concept = data.get('concept', c.concept)
     c.difficulty = data.get('difficulty', c.difficulty)
     db.session.commit()
+    invalidate_challenges_cache()
 
     return jsonify({'message': f'Challenge {c.id} updated successfully!'})
 
@@ -371,17 +529,18 @@ def update_challenge(challenge_id):
 def delete_challenge(challenge_id):
     data = request.get_json()
     username = data.get('username')
-    user = User.query.filter_by(username=username).first()
+    user = db.session.query(User.role).filter_by(username=username).first()
 
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     c = Challenge.query.get_or_404(challenge_id)
     db.session.delete(c)
     db.session.commit()
+    invalidate_challenges_cache()
     return jsonify({'message': f'Challenge {c.title} deleted successfully!'})
 
 
@@ -394,7 +553,7 @@ def add_test_case(challenge_id):
     user = get_user_from_payload(data)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     challenge = Challenge.query.get_or_404(challenge_id)
@@ -416,7 +575,7 @@ def delete_test_case(test_case_id):
     user = get_user_from_payload(data)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     tc = TestCase.query.get_or_404(test_case_id)
@@ -434,7 +593,7 @@ def add_solution_template(challenge_id):
     user = get_user_from_payload(data)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     name = data.get('name')
@@ -460,7 +619,7 @@ def delete_solution_template(template_id):
     user = get_user_from_payload(data)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     tpl = SolutionTemplate.query.get_or_404(template_id)
@@ -474,7 +633,11 @@ def delete_solution_template(template_id):
 # =====================================================
 @app.route('/challenges/<int:challenge_id>/export', methods=['GET'])
 def export_challenge(challenge_id):
-    c = Challenge.query.get_or_404(challenge_id)
+    c = Challenge.query.options(
+        selectinload(Challenge.test_cases),
+        selectinload(Challenge.solution_templates),
+        raiseload('*')
+    ).get_or_404(challenge_id)
     return jsonify({
         'challenge': {
             'title': c.title,
@@ -509,10 +672,14 @@ def copy_challenge(challenge_id):
     user = get_user_from_payload(data)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
-    c = Challenge.query.get_or_404(challenge_id)
+    c = Challenge.query.options(
+        selectinload(Challenge.test_cases),
+        selectinload(Challenge.solution_templates),
+        raiseload('*')
+    ).get_or_404(challenge_id)
     new_c = Challenge(
         title=f"{c.title} (Copy)",
         description=c.description,
@@ -524,23 +691,32 @@ def copy_challenge(challenge_id):
     )
     db.session.add(new_c)
     db.session.flush()
+    store_required_blocks(new_c.id, c.required_blocks)
 
-    for tc in c.test_cases:
-        db.session.add(TestCase(
-            challenge_id=new_c.id,
-            input_data=tc.input_data,
-            expected_output=tc.expected_output,
-            description=tc.description
-        ))
-    for st in c.solution_templates:
-        db.session.add(SolutionTemplate(
-            challenge_id=new_c.id,
-            name=st.name,
-            code_json=st.code_json,
-            description=st.description
-        ))
+    # One executemany INSERT per child table instead of a Unit-of-Work flush per row
+    tc_rows = [
+        {
+            'challenge_id': new_c.id,
+            'input_data': tc.input_data,
+            'expected_output': tc.expected_output,
+            'description': tc.description
+        } for tc in c.test_cases
+    ]
+    st_rows = [
+        {
+            'challenge_id': new_c.id,
+            'name': st.name,
+            'code_json': st.code_json,
+            'description': st.description
+        } for st in c.solution_templates
+    ]
+    if tc_rows:
+        db.session.execute(insert(TestCase), tc_rows)
+    if st_rows:
+        db.session.execute(insert(SolutionTemplate), st_rows)
 
     db.session.commit()
+    invalidate_challenges_cache()
     return jsonify({'message': 'Challenge copied successfully!', 'new_challenge_id': new_c.id}), 201
 
 
@@ -550,7 +726,7 @@ def import_challenge():
     user = get_user_from_payload(data)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(user.role, ['teacher']):
+    if not check_role(user.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     challenge_data = data.get('challenge') or {}
@@ -568,32 +744,74 @@ def import_challenge():
     )
     db.session.add(c)
     db.session.flush()
+    store_required_blocks(c.id, c.required_blocks)
 
-    for tc in (data.get('test_cases') or []):
-        db.session.add(TestCase(
-            challenge_id=c.id,
-            input_data=tc.get('input_data'),
-            expected_output=tc.get('expected_output'),
-            description=tc.get('description')
-        ))
-
-    for st in (data.get('solution_templates') or []):
-        if not st.get('name') or not st.get('code_json'):
-            continue
-        db.session.add(SolutionTemplate(
-            challenge_id=c.id,
-            name=st.get('name'),
-            code_json=st.get('code_json'),
-            description=st.get('description')
-        ))
+    tc_rows = [
+        {
+            'challenge_id': c.id,
+            'input_data': tc.get('input_data'),
+            'expected_output': tc.get('expected_output'),
+            'description': tc.get('description')
+        } for tc in (data.get('test_cases') or [])
+    ]
+    st_rows = [
+        {
+            'challenge_id': c.id,
+            'name': st.get('name'),
+            'code_json': st.get('code_json'),
+            'description': st.get('description')
+        } for st in (data.get('solution_templates') or [])
+        if st.get('name') and st.get('code_json')
+    ]
+    if tc_rows:
+        db.session.execute(insert(TestCase), tc_rows)
+    if st_rows:
+        db.session.execute(insert(SolutionTemplate), st_rows)
 
     db.session.commit()
+    invalidate_challenges_cache()
     return jsonify({'message': 'Challenge imported successfully!', 'challenge_id': c.id}), 201
 
 # =====================================================
 # Simple Evaluation Function
 # =====================================================
 import json
+import hashlib
+
+try:
+    import redis
+except ImportError:  # optional: evaluation results are only cached when Redis is available
+    redis = None
+
+# Students often resubmit identical code; cache the attempt-independent part of the
+# evaluation keyed by (challenge, required blocks, canonical code). Enabled via REDIS_URL.
+_EVAL_CACHE_TTL = 3600
+_eval_cache = redis.Redis.from_url(os.environ['REDIS_URL']) if redis and os.environ.get('REDIS_URL') else None
+
+
+def _eval_cache_key(challenge, required_blocks, data):
+    try:
+        canonical = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        # Valid JSON orjson cannot encode (over 254 nesting levels, integers wider than 64 bits): skip caching
+        return None
+    digest = hashlib.sha256(f"{required_blocks}\0".encode() + canonical).hexdigest()
+    return f"eval:{challenge.id if challenge else 0}:{digest}"
+
+
+def _eval_cache_get(key):
+    try:
+        cached = _eval_cache.get(key)
+    except redis.RedisError:
+        return None
+    return orjson.loads(cached) if cached else None
+
+
+def _eval_cache_set(key, value):
+    try:
+        _eval_cache.setex(key, _EVAL_CACHE_TTL, orjson.dumps(value))
+    except redis.RedisError:
+        pass
 
 
 def evaluate_code(code_json, required_blocks, user=None, challenge=None):
@@ -606,14 +824,16 @@ def evaluate_code(code_json, required_blocks, user=None, challenge=None):
     - دمج المحاولات السابقة لتوليد تغذية راجعة تربوية
     """
 
-    feedback_parts = []
-    result = "fail"
-
     try:
         # =============================
         # 1️⃣ تحليل JSON واستخراج الكتل
         # =============================
-        data = json.loads(code_json)
+        # تجاوز المحلل للمدخلات الفارغة بشكل واضح
+        stripped = code_json.strip() if code_json else ''
+        if not stripped or stripped in ('{}', '[]'):
+            return "fail", "الكود فارغ. أضف بعض الكتل البرمجية للبدء."
+
+        data = json.loads(stripped)
 
         # Blockly workspace format: {"blockly_xml": "..."}
         if isinstance(data, dict) and data.get('blockly_xml'):
@@ -624,76 +844,34 @@ def evaluate_code(code_json, required_blocks, user=None, challenge=None):
         if not blocks:
             return "fail", "الكود فارغ. أضف بعض الكتل البرمجية للبدء."
 
-        submitted_blocks = extract_blocks_recursive(blocks)
-        feedback_parts.append(f"عدد الكتل المكتشفة: {len(submitted_blocks)}.")
-
-        # =============================
-        # 2️⃣ التحقق المفاهيمي لكل كتلة
-        # =============================
-        conceptual_feedback = []
-        for block in blocks:
-            error = validate_block_logic(block)
-            if error:
-                conceptual_feedback.append(error)
-
-        if conceptual_feedback:
-            feedback_parts.append("تحقق من منطق الكتل:\n- " + "\n- ".join(conceptual_feedback))
-
-        # =============================
-        # 3️⃣ مقارنة مع الكتل المطلوبة
-        # =============================
-        if required_blocks:
-            required = [b.strip() for b in required_blocks.split(",")]
-            missing = [r for r in required if r not in submitted_blocks]
-            if missing:
-                feedback_parts.append("الكود غير مكتمل. ينقصك الكتل: " + ", ".join(missing))
-            else:
-                feedback_parts.append("✅ استخدمت جميع الكتل المطلوبة بنجاح!")
-                result = "success"
-
-        # =============================
-        # 4️⃣ تحليل العمق البنائي (Nested Depth)
-        # =============================
-        max_depth = max(block_depth(b) for b in blocks)
-        if max_depth > 4:
-            feedback_parts.append("الكود معقد قليلاً (عمق التداخل كبير). حاول تبسيط الحل.")
+        # الخطوات 2️⃣-4️⃣ و 6️⃣-7️⃣ لا تعتمد على الطالب، لذا يمكن تخزينها مؤقتاً
+        cache_key = _eval_cache_key(challenge, required_blocks, data) if _eval_cache is not None else None
+        cached = _eval_cache_get(cache_key) if cache_key else None
+        if cached:
+            result, feedback_parts, attempt_index = cached
+        else:
+            result, feedback_parts, attempt_index = _evaluate_blocks(blocks, required_blocks, challenge)
+            if cache_key:
+                _eval_cache_set(cache_key, [result, feedback_parts, attempt_index])
 
         # =============================
         # 5️⃣ تحليل سلوكي من محاولات الطالب السابقة
         # =============================
         if user and challenge:
-            attempt_count = Submission.query.filter_by(
+            attempt_count = db.session.query(func.count(Submission.id)).filter_by(
                 student_id=user.id,
                 challenge_id=challenge.id
-            ).count()
+            ).scalar()
 
             if attempt_count == 0:
-                feedback_parts.append("🎯 هذه أول محاولة لك! حظًا موفقًا.")
+                attempt_feedback = "🎯 هذه أول محاولة لك! حظًا موفقًا."
             elif attempt_count == 1:
-                feedback_parts.append("📘 محاولة ثانية ممتازة! فكر أكثر في ترتيب الكتل.")
+                attempt_feedback = "📘 محاولة ثانية ممتازة! فكر أكثر في ترتيب الكتل."
             elif attempt_count == 2:
-                feedback_parts.append("💪 أنت تتحسن! بقيت خطوة بسيطة نحو الحل الكامل.")
+                attempt_feedback = "💪 أنت تتحسن! بقيت خطوة بسيطة نحو الحل الكامل."
             else:
-                feedback_parts.append("🌟 رائع! إصرارك واضح، استمر بالمحاولة!")
-
-        # =============================
-        # 6️⃣ حساب نسبة التوافق (Scoring)
-        # =============================
-        if required_blocks:
-            required = [b.strip() for b in required_blocks.split(",")]
-            correct_count = len([r for r in required if r in submitted_blocks])
-            score = int(correct_count / len(required) * 100)
-        else:
-            score = 0
-
-        feedback_parts.append(f"🔹 النتيجة التقريبية: {score}%")
-
-        # =============================
-        # 7️⃣ تحديد النتيجة النهائية
-        # =============================
-        if result == "success" and conceptual_feedback:
-            result = "partial"
-            feedback_parts.append("✔ الحل قريب جدًا من الكمال، فقط أصلح الملاحظات أعلاه.")
+                attempt_feedback = "🌟 رائع! إصرارك واضح، استمر بالمحاولة!"
+            feedback_parts.insert(attempt_index, attempt_feedback)
 
         # دمج النصوص في تغذية واحدة
         feedback_text = "\n".join(feedback_parts)
@@ -705,18 +883,102 @@ def evaluate_code(code_json, required_blocks, user=None, challenge=None):
         return "fail", f"حدث خطأ أثناء تحليل الكود: {str(e)}"
 
 
+def _evaluate_blocks(blocks, required_blocks, challenge=None):
+    """
+    الجزء من التقييم الذي لا يعتمد على محاولات الطالب.
+    Returns: (result, feedback_parts, attempt_index) حيث attempt_index هو موضع رسالة المحاولات
+    """
+    feedback_parts = []
+    result = "fail"
+
+    submitted_blocks, max_depth = walk_blocks(blocks)
+    submitted_set = set(submitted_blocks)
+    required = []
+    if challenge is not None:
+        required = list(db.session.execute(
+            select(ChallengeRequiredBlock.block_name)
+            .where(ChallengeRequiredBlock.challenge_id == challenge.id)
+            .order_by(ChallengeRequiredBlock.position)
+        ).scalars())
+    if not required:
+        # Challenges saved before ChallengeRequiredBlock existed
+        required = parse_required_blocks(required_blocks)
+    missing = [r for r in required if r not in submitted_set]
+    feedback_parts.append(f"عدد الكتل المكتشفة: {len(submitted_blocks)}.")
+
+    # =============================
+    # 2️⃣ التحقق المفاهيمي لكل كتلة
+    # =============================
+    conceptual_feedback = []
+    for block in blocks:
+        error = validate_block_logic(block)
+        if error:
+            conceptual_feedback.append(error)
+
+    if conceptual_feedback:
+        feedback_parts.append("تحقق من منطق الكتل:\n- " + "\n- ".join(conceptual_feedback))
+
+    # =============================
+    # 3️⃣ مقارنة مع الكتل المطلوبة
+    # =============================
+    if required:
+        if missing:
+            feedback_parts.append("الكود غير مكتمل. ينقصك الكتل: " + ", ".join(missing))
+        else:
+            feedback_parts.append("✅ استخدمت جميع الكتل المطلوبة بنجاح!")
+            result = "success"
+
+    # =============================
+    # 4️⃣ تحليل العمق البنائي (Nested Depth)
+    # =============================
+    if max_depth > 4:
+        feedback_parts.append("الكود معقد قليلاً (عمق التداخل كبير). حاول تبسيط الحل.")
+
+    # 5️⃣ رسالة المحاولات تُضاف هنا في evaluate_code
+    attempt_index = len(feedback_parts)
+
+    # =============================
+    # 6️⃣ حساب نسبة التوافق (Scoring)
+    # =============================
+    if required:
+        correct_count = len(required) - len(missing)
+        score = int(correct_count / len(required) * 100)
+    else:
+        score = 0
+
+    feedback_parts.append(f"🔹 النتيجة التقريبية: {score}%")
+
+    # =============================
+    # 7️⃣ تحديد النتيجة النهائية
+    # =============================
+    if result == "success" and conceptual_feedback:
+        result = "partial"
+        feedback_parts.append("✔ الحل قريب جدًا من الكمال، فقط أصلح الملاحظات أعلاه.")
+
+    return result, feedback_parts, attempt_index
+
+
 # ======================================
 # 🔧 دوال مساعدة تستخدم داخل التقييم
 # ======================================
 
-def extract_blocks_recursive(blocks):
-    """استخراج جميع أنواع الكتل بما في ذلك المتداخلة."""
-    result = []
-    for block in blocks:
-        result.append(block.get("type"))
-        if "body" in block and isinstance(block["body"], list):
-            result.extend(extract_blocks_recursive(block["body"]))
-    return result
+def walk_blocks(blocks):
+    """
+    مرور واحد (بدون استدعاء ذاتي) على الكتل المتداخلة:
+    يعيد (أنواع جميع الكتل بالترتيب, أقصى عمق تداخل).
+    """
+    types = []
+    max_depth = 0
+    stack = [(b, 1) for b in reversed(blocks)]
+    while stack:
+        block, depth = stack.pop()
+        types.append(block.get("type"))
+        if depth > max_depth:
+            max_depth = depth
+        body = block.get("body")
+        if body and isinstance(body, list):
+            stack.extend((child, depth + 1) for child in reversed(body))
+    return types, max_depth
 
 
 def validate_block_logic(block):
@@ -733,13 +995,6 @@ def validate_block_logic(block):
     return None
 
 
-def block_depth(block):
-    """حساب عمق التداخل البنائي داخل الكتل."""
-    if "body" not in block or not block["body"]:
-        return 1
-    return 1 + max(block_depth(b) for b in block["body"])
-
-
 # =====================================================
 # 🔎 عرض جميع المحاولات الخاصة بطالب معيّن
 # =====================================================
@@ -749,18 +1004,23 @@ def get_submissions(username):
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    submissions = Submission.query.filter_by(student_id=user.id).all()
-    if not submissions:
+    # Streamed in batches so a long history is never fully materialized
+    q = db.session.query(
+        Submission.id, Submission.challenge_id, Submission.result, Submission.feedback_text
+    ).filter_by(student_id=user.id).order_by(Submission.id).yield_per(200)
+    rows = iter(q)
+    first = next(rows, None)
+    if first is None:
         return jsonify({'message': 'No submissions found for this student.'}), 200
 
-    return jsonify([
+    return stream_json_array(
         {
             'id': s.id,
             'challenge_id': s.challenge_id,
             'result': s.result,
             'feedback_text': s.feedback_text
-        } for s in submissions
-    ])
+        } for s in itertools.chain((first,), rows)
+    )
 
 
 # =====================================================
@@ -772,42 +1032,69 @@ def teacher_list_submissions():
     teacher = get_user_from_payload(data)
     if not teacher:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(teacher.role, ['teacher']):
+    if not check_role(teacher.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     challenge_id = data.get('challenge_id')
     student_username = (data.get('student_username') or '').strip()
 
-    q = Submission.query
+    filters = []
     if challenge_id:
-        q = q.filter(Submission.challenge_id == challenge_id)
+        filters.append(Submission.challenge_id == challenge_id)
 
+    student_id = None
     if student_username:
-        student = User.query.filter_by(username=student_username).first()
-        if not student:
+        student_id = db.session.execute(
+            select(User.id).where(User.username == student_username)
+        ).scalar()
+        if student_id is None:
             return jsonify({'error': 'Student not found'}), 404
-        q = q.filter(Submission.student_id == student.id)
-
-    subs = q.order_by(Submission.id.desc()).limit(200).all()
-
-    # Preload usernames and challenge titles
-    user_ids = list({s.student_id for s in subs})
-    ch_ids = list({s.challenge_id for s in subs})
-    users = {u.id: u.username for u in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
-    chs = {c.id: c.title for c in Challenge.query.filter(Challenge.id.in_(ch_ids)).all()} if ch_ids else {}
-
-    return jsonify([
+        filters.append(Submission.student_id == student_id)
+
+    def latest(*columns):
+        # Plain column rows (no ORM objects); usernames and titles come from the same query
+        return db.session.execute(
+            select(*columns)
+            .outerjoin(User, User.id == Submission.student_id)
+            .outerjoin(Challenge, Challenge.id == Submission.challenge_id)
+            .where(*filters)
+            .order_by(Submission.id.desc())
+            .limit(200)
+        )
+
+    # ETag = hash of the listed ids plus the columns that can change after insert
+    # (grading, renames), read by any worker or before a restart. student_id,
+    # challenge_id and code_json never change, so a 304 skips reading code_json at all.
+    etag = hashlib.sha1(orjson.dumps([
+        tuple(r) for r in latest(
+            Submission.id, Submission.result, Submission.feedback_text, User.username, Challenge.title
+        )
+    ])).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    rows = latest(
+        Submission.id, Submission.student_id, Submission.challenge_id,
+        Submission.result, Submission.feedback_text, Submission.code_json,
+        User.username, Challenge.title
+    )
+    resp = stream_json_array(
         {
-            'id': s.id,
-            'student_id': s.student_id,
-            'student_username': users.get(s.student_id, ''),
-            'challenge_id': s.challenge_id,
-            'challenge_title': chs.get(s.challenge_id, ''),
-            'result': s.result,
-            'feedback_text': s.feedback_text,
-            'code_json': s.code_json
-        } for s in subs
-    ])
+            'id': r.id,
+            'student_id': r.student_id,
+            'student_username': r.username or '',
+            'challenge_id': r.challenge_id,
+            'challenge_title': r.title or '',
+            'result': r.result,
+            'feedback_text': r.feedback_text,
+            'code_json': r.code_json
+        } for r in rows
+    )
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
 
 
 @app.route('/teacher/submissions/<int:submission_id>', methods=['PUT'])
@@ -816,7 +1103,7 @@ def teacher_update_submission(submission_id):
     teacher = get_user_from_payload(data)
     if not teacher:
         return jsonify({'error': 'User not found'}), 404
-    if not check_role(teacher.role, ['teacher']):
+    if not check_role(teacher.role, _TEACHER_ROLES):
         return jsonify({'error': 'Access denied'}), 403
 
     s = Submission.query.get_or_404(submission_id)
@@ -833,6 +1120,11 @@ def teacher_update_submission(submission_id):
 # =====================================================
 # 9️⃣ Submit Challenge Solution (Student only)
 # =====================================================
+# Opt-in write batching for submission bursts (a whole class pressing "submit" at once):
+# rows are queued and inserted together every 50ms or every 32 rows (see submission_writer.py).
+submission_writer = SubmissionWriter(app)
+
+
 @app.route('/submit', methods=['POST'])
 def submit():
     data = request.get_json()
@@ -840,16 +1132,25 @@ def submit():
     challenge_id = data.get('challenge_id')
     code_json = data.get('code_json')
 
-    # التأكد من وجود المستخدم
-    user = User.query.filter_by(username=username).first()
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-
-    # التأكد من وجود التحدي
-    challenge = Challenge.query.get(challenge_id)
-    if not challenge:
+    # جلب المستخدم والتحدي في استعلام واحد (الأعمدة المطلوبة فقط)
+    row = db.session.execute(
+        select(User, Challenge)
+        .join_from(User, Challenge, true())  # explicit cross join: both sides are filtered to one row
+        .where(User.username == username, Challenge.id == challenge_id)
+        .options(
+            load_only(User.id, User.username),
+            load_only(Challenge.id, Challenge.title, Challenge.required_blocks)
+        )
+    ).first()
+
+    if row is None:
+        # التأكد من وجود المستخدم ثم التحدي (فقط عند الفشل)
+        if db.session.query(User.id).filter_by(username=username).first() is None:
+            return jsonify({'error': 'User not found'}), 404
         return jsonify({'error': 'Challenge not found'}), 404
 
+    user, challenge = row
+
     # 🔹 استدعاء التقييم المتقدم مع جميع المعاملات
     result, feedback = evaluate_code(
         code_json,
@@ -859,15 +1160,14 @@ def submit():
     )
 
     # حفظ النتيجة في قاعدة البيانات
-    submission = Submission(
-        student_id=user.id,
-        challenge_id=challenge.id,
-        code_json=code_json,
-        result=result,
-        feedback_text=feedback
-    )
-    db.session.add(submission)
-    db.session.commit()
+    row = {
+        'student_id': user.id,
+        'challenge_id': challenge.id,
+        'code_json': code_json,
+        'result': result,
+        'feedback_text': feedback
+    }
+    save_submission(app, row)
 
     return jsonify({
         'message': 'Submission recorded successfully!',
@@ -881,4 +1181,6 @@ def submit():
 # Run the app
 # =====================================================
 if __name__ == '__main__':
+    # Disable caching in development to avoid stale JS/CSS
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
     app.run(debug=True, use_reloader=False)
@@ -6,10 +6,18 @@
 """
 
 import json
+import weakref
+from functools import lru_cache
 from typing import List, Dict, Any, Optional, Set, Tuple
 from enum import Enum
 from dataclasses import dataclass, field
 
+try:
+    # orjson.JSONDecodeError يرث من json.JSONDecodeError لذا تبقى معالجة الأخطاء كما هي
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
 
 # =====================================================
 # 1️⃣ Node Types Definition
@@ -33,19 +41,25 @@ class NodeType(Enum):
 # =====================================================
 # 2️⃣ AST Node Classes
 # =====================================================
-@dataclass
+@dataclass(slots=True, weakref_slot=True)
 class ASTNode:
     """عقدة أساسية في شجرة التحليل"""
     node_type: NodeType
     line_number: int = 0
     children: List['ASTNode'] = field(default_factory=list)
-    parent: Optional['ASTNode'] = None
+    # مرجع ضعيف للأب لتجنب الدورات parent ↔ child
+    _parent_ref: Optional[weakref.ref] = field(default=None, repr=False, compare=False)
     metadata: Dict[str, Any] = field(default_factory=dict)
 
+    @property
+    def parent(self) -> Optional['ASTNode']:
+        """العقدة الأب (أو None للجذر)"""
+        return self._parent_ref() if self._parent_ref is not None else None
+
     def add_child(self, child: 'ASTNode') -> None:
         """إضافة عقدة فرعية"""
         self.children.append(child)
-        child.parent = self
+        child._parent_ref = weakref.ref(self)
 
     def get_depth(self) -> int:
         """الحصول على عمق العقدة في الشجرة"""
@@ -57,92 +71,76 @@ class ASTNode:
         return f"<{self.node_type.value}@{self.line_number}>"
 
 
-@dataclass
+@dataclass(slots=True)
 class LoopNode(ASTNode):
     """عقدة حلقة (Loop)"""
+    node_type: NodeType = NodeType.LOOP
     iterations: Optional[int] = None  # عدد مرات التكرار
     condition: Optional[str] = None  # شرط الحلقة (for, while)
     has_exit: bool = False  # هل توجد طريقة للخروج من الحلقة؟
 
-    def __post_init__(self):
-        self.node_type = NodeType.LOOP
-
 
-@dataclass
+@dataclass(slots=True)
 class IfNode(ASTNode):
     """عقدة الشرط (If)"""
+    node_type: NodeType = NodeType.IF
     condition: Optional[str] = None
     has_else: bool = False
     else_body: List[ASTNode] = field(default_factory=list)
 
-    def __post_init__(self):
-        self.node_type = NodeType.IF
 
-
-@dataclass
+@dataclass(slots=True)
 class VariableNode(ASTNode):
     """عقدة المتغير (Variable)"""
+    node_type: NodeType = NodeType.VARIABLE
     var_name: Optional[str] = None
     initial_value: Optional[Any] = None
     data_type: str = "unknown"  # int, string, boolean
 
-    def __post_init__(self):
-        self.node_type = NodeType.VARIABLE
-
 
-@dataclass
+@dataclass(slots=True)
 class AssignmentNode(ASTNode):
     """عقدة الإسناد (Assignment)"""
+    node_type: NodeType = NodeType.ASSIGNMENT
     var_name: Optional[str] = None
     value: Optional[Any] = None
     operator: str = "="  # =, +=, -=, etc.
 
-    def __post_init__(self):
-        self.node_type = NodeType.ASSIGNMENT
 
-
-@dataclass
+@dataclass(slots=True)
 class PrintNode(ASTNode):
     """عقدة الطباعة (Print)"""
+    node_type: NodeType = NodeType.PRINT
     output: Optional[str] = None
     references_variable: Optional[str] = None
 
-    def __post_init__(self):
-        self.node_type = NodeType.PRINT
-
 
-@dataclass
+@dataclass(slots=True)
 class FunctionNode(ASTNode):
     """عقدة تعريف الدالة (Function Definition)"""
+    node_type: NodeType = NodeType.FUNCTION
     function_name: Optional[str] = None
     parameters: List[str] = field(default_factory=list)
     return_type: str = "void"
     body: List[ASTNode] = field(default_factory=list)
 
-    def __post_init__(self):
-        self.node_type = NodeType.FUNCTION
-
 
-@dataclass
+@dataclass(slots=True)
 class FunctionCallNode(ASTNode):
     """عقدة استدعاء الدالة (Function Call)"""
+    node_type: NodeType = NodeType.FUNCTION_CALL
     function_name: Optional[str] = None
     arguments: List[Any] = field(default_factory=list)
 
-    def __post_init__(self):
-        self.node_type = NodeType.FUNCTION_CALL
 
-
-@dataclass
+@dataclass(slots=True)
 class SwitchNode(ASTNode):
     """عقدة switch"""
+    node_type: NodeType = NodeType.SWITCH
     expression: Optional[str] = None
     cases: Dict[str, List[ASTNode]] = field(default_factory=dict)
     default_body: List[ASTNode] = field(default_factory=list)
 
-    def __post_init__(self):
-        self.node_type = NodeType.SWITCH
-
 
 # =====================================================
 # 3️⃣ AST Parser - يحول JSON إلى AST
@@ -158,14 +156,18 @@ class ASTParser:
         self.line_counter = 0
         self.variables: Set[str] = set()
         self.functions: Dict[str, FunctionNode] = {}
+        # الكتل الفرعية التي جدولتها العقدة الحالية: (block, attach)
+        self._pending: List[Tuple[Dict[str, Any], Any]] = []
 
     def parse(self, code_json: str) -> ASTNode:
         """
         تحويل JSON إلى AST
         Returns: Root node of the AST
         """
+        # تحليل سابق فشل في منتصفه قد يترك كتلاً مجدولة لم تُعالج
+        self._pending.clear()
         try:
-            data = json.loads(code_json)
+            data = _json_loads(code_json)
             blocks = data.get("blocks", [])
 
             self.root = ASTNode(
@@ -174,10 +176,7 @@ class ASTParser:
                 metadata={"total_blocks": len(blocks)}
             )
 
-            for block in blocks:
-                node = self._parse_block(block)
-                if node:
-                    self.root.add_child(node)
+            self._parse_blocks(blocks, self.root.add_child)
 
             return self.root
 
@@ -186,47 +185,51 @@ class ASTParser:
         except Exception as e:
             raise ValueError(f"خطأ في بناء AST: {str(e)}")
 
-    def _parse_block(self, block: Dict[str, Any], parent: Optional[ASTNode] = None) -> Optional[ASTNode]:
+    def _parse_blocks(self, blocks: List[Dict[str, Any]], attach) -> None:
+        """
+        تحليل الكتل بشكل تكراري (بدون recursion) باستخدام مكدس عمل
+        كل عنصر: (الكتلة، دالة ربط العقدة الناتجة بمكانها في الشجرة)
+        أو (None، دالة) لخطوة مؤجلة بعد الكتل الفرعية
+        يحافظ على ترتيب pre-order وترقيم الأسطر كما في التحليل العودي
+        """
+        stack = [(block, attach) for block in reversed(blocks)]
+        pending = self._pending
+        while stack:
+            block, attach = stack.pop()
+            if block is None:
+                # خطوة مؤجلة تُنفَّذ بعد انتهاء تحليل الكتل الفرعية
+                attach()
+                continue
+            node = self._parse_block(block)
+            if node:
+                attach(node)
+            if pending:
+                stack.extend(reversed(pending))
+                pending.clear()
+
+    def _schedule(self, blocks: List[Dict[str, Any]], attach) -> None:
+        """جدولة كتل فرعية ليتم تحليلها بعد العقدة الحالية"""
+        self._pending.extend((block, attach) for block in blocks)
+
+    def _parse_block(self, block: Dict[str, Any]) -> Optional[ASTNode]:
         """
         تحليل كتلة واحدة وتحويلها إلى عقدة AST
         """
         self.line_counter += 1
-        block_type = block.get("type")
-
-        if block_type == "loop":
-            return self._parse_loop(block)
-        elif block_type == "if":
-            return self._parse_if(block)
-        elif block_type == "print":
-            return self._parse_print(block)
-        elif block_type == "variable":
-            return self._parse_variable(block)
-        elif block_type == "assignment":
-            return self._parse_assignment(block)
-        elif block_type == "function":
-            return self._parse_function(block)
-        elif block_type == "function_call":
-            return self._parse_function_call(block)
-        elif block_type == "switch":
-            return self._parse_switch(block)
-        else:
-            return None
+        handler = self._DISPATCH.get(block.get("type"))
+        return handler(self, block) if handler else None
 
     def _parse_loop(self, block: Dict[str, Any]) -> LoopNode:
         """تحليل كتلة الحلقة"""
-        node = LoopNode(line_number=self.line_counter)
-        node.iterations = block.get("iterations")
-        node.condition = block.get("condition")
+        g = block.get
+        node = LoopNode(line_number=self.line_counter, iterations=g("iterations"), condition=g("condition"))
 
         # تحليل body (محتويات الحلقة)
-        body = block.get("body", [])
-        for body_block in body:
-            child = self._parse_block(body_block, node)
-            if child:
-                node.add_child(child)
+        body = g("body", [])
+        self._schedule(body, node.add_child)
 
         # التحقق من وجود طريقة للخروج
-        node.has_exit = block.get("has_exit", False) or node.condition is not None
+        node.has_exit = g("has_exit", False) or node.condition is not None
 
         node.metadata = {
             "iterations": node.iterations,
@@ -239,24 +242,18 @@ class ASTParser:
 
     def _parse_if(self, block: Dict[str, Any]) -> IfNode:
         """تحليل كتلة الشرط"""
-        node = IfNode(line_number=self.line_counter)
-        node.condition = block.get("condition")
+        g = block.get
+        node = IfNode(line_number=self.line_counter, condition=g("condition"))
 
         # تحليل body (نعم)
-        body = block.get("body", [])
-        for body_block in body:
-            child = self._parse_block(body_block, node)
-            if child:
-                node.add_child(child)
+        body = g("body", [])
+        self._schedule(body, node.add_child)
 
         # تحليل else body (لا)
-        else_body = block.get("else_body", [])
+        else_body = g("else_body", [])
         if else_body:
             node.has_else = True
-            for else_block in else_body:
-                child = self._parse_block(else_block, node)
-                if child:
-                    node.else_body.append(child)
+            self._schedule(else_body, node.else_body.append)
 
         node.metadata = {
             "condition": node.condition,
@@ -282,10 +279,13 @@ class ASTParser:
 
     def _parse_variable(self, block: Dict[str, Any]) -> VariableNode:
         """تحليل كتلة المتغير"""
-        node = VariableNode(line_number=self.line_counter)
-        node.var_name = block.get("name")
-        node.initial_value = block.get("value")
-        node.data_type = block.get("data_type", "unknown")
+        g = block.get
+        node = VariableNode(
+            line_number=self.line_counter,
+            var_name=g("name"),
+            initial_value=g("value"),
+            data_type=g("data_type", "unknown")
+        )
 
         if node.var_name:
             self.variables.add(node.var_name)
@@ -300,10 +300,13 @@ class ASTParser:
 
     def _parse_assignment(self, block: Dict[str, Any]) -> AssignmentNode:
         """تحليل كتلة الإسناد"""
-        node = AssignmentNode(line_number=self.line_counter)
-        node.var_name = block.get("var_name")
-        node.value = block.get("value")
-        node.operator = block.get("operator", "=")
+        g = block.get
+        node = AssignmentNode(
+            line_number=self.line_counter,
+            var_name=g("var_name"),
+            value=g("value"),
+            operator=g("operator", "=")
+        )
 
         node.metadata = {
             "var_name": node.var_name,
@@ -315,20 +318,25 @@ class ASTParser:
 
     def _parse_function(self, block: Dict[str, Any]) -> FunctionNode:
         """تحليل كتلة تعريف الدالة"""
-        node = FunctionNode(line_number=self.line_counter)
-        node.function_name = block.get("name")
-        node.parameters = block.get("parameters", [])
-        node.return_type = block.get("return_type", "void")
-
-        body = block.get("body", [])
-        for body_block in body:
-            child = self._parse_block(body_block, node)
-            if child:
-                node.body.append(child)
-                node.add_child(child)
+        g = block.get
+        node = FunctionNode(
+            line_number=self.line_counter,
+            function_name=g("name"),
+            parameters=g("parameters", []),
+            return_type=g("return_type", "void")
+        )
+
+        body = g("body", [])
+
+        def attach_body(child: ASTNode) -> None:
+            node.body.append(child)
+            node.add_child(child)
+
+        self._schedule(body, attach_body)
 
         if node.function_name:
-            self.functions[node.function_name] = node
+            # يُسجَّل بعد تحليل body (نفس ترتيب التحليل العودي)
+            self._pending.append((None, lambda: self.functions.__setitem__(node.function_name, node)))
 
         node.metadata = {
             "function_name": node.function_name,
@@ -355,22 +363,16 @@ class ASTParser:
 
     def _parse_switch(self, block: Dict[str, Any]) -> SwitchNode:
         """تحليل كتلة switch"""
-        node = SwitchNode(line_number=self.line_counter)
-        node.expression = block.get("expression")
+        g = block.get
+        node = SwitchNode(line_number=self.line_counter, expression=g("expression"))
 
-        cases = block.get("cases", {})
+        cases = g("cases", {})
         for case_value, case_body in cases.items():
             node.cases[case_value] = []
-            for case_block in case_body:
-                child = self._parse_block(case_block, node)
-                if child:
-                    node.cases[case_value].append(child)
+            self._schedule(case_body, node.cases[case_value].append)
 
-        default = block.get("default", [])
-        for def_block in default:
-            child = self._parse_block(def_block, node)
-            if child:
-                node.default_body.append(child)
+        default = g("default", [])
+        self._schedule(default, node.default_body.append)
 
         node.metadata = {
             "expression": node.expression,
@@ -380,6 +382,28 @@ class ASTParser:
 
         return node
 
+    # جدول توزيع نوع الكتلة → دالة التحليل (يُبنى مرة واحدة على مستوى الصنف)
+    _DISPATCH = {
+        "loop": _parse_loop,
+        "if": _parse_if,
+        "print": _parse_print,
+        "variable": _parse_variable,
+        "assignment": _parse_assignment,
+        "function": _parse_function,
+        "function_call": _parse_function_call,
+        "switch": _parse_switch,
+    }
+
+
+# مفتاح قائمة التحليل → اسم الكتلة
+_BLOCK_TYPE_KEYS = (
+    ("loops", "loop"),
+    ("ifs", "if"),
+    ("prints", "print"),
+    ("variables", "variable"),
+    ("functions", "function"),
+)
+
 
 # =====================================================
 # 4️⃣ AST Analyzer - استخراج معلومات مهمة
@@ -403,35 +427,50 @@ class ASTAnalyzer:
             "warnings": [],
             "metrics": {}
         }
+        # مشاكل كل فئة تُجمع أثناء المرور، ثم تُدمج بنفس ترتيب الفئات
+        self._issues: Dict[str, List[str]] = {
+            "loops": [], "ifs": [], "prints": [], "variables": [], "functions": []
+        }
 
     def analyze(self) -> Dict[str, Any]:
         """تنفيذ التحليل الكامل"""
-        self._traverse_tree(self.root, depth=0)
+        self._traverse_tree(self.root)
+        return self._finish()
+
+    def _finish(self) -> Dict[str, Any]:
+        """استخراج المقاييس والمشاكل بعد انتهاء المرور على الشجرة"""
         self._extract_metrics()
-        self._validate_logic()
+        for issues in self._issues.values():
+            self.analysis_result["issues"].extend(issues)
+        # أنواع الكتل الموجودة في الشجرة (للمقارنة مع الكتل المطلوبة للتحدي)
+        self.analysis_result["block_types"] = [
+            block_name for key, block_name in _BLOCK_TYPE_KEYS if self.analysis_result[key]
+        ]
         return self.analysis_result
 
-    def _traverse_tree(self, node: ASTNode, depth: int = 0) -> None:
-        """المرور على جميع عقد الشجرة"""
-        self.analysis_result["total_nodes"] += 1
-        self.analysis_result["max_nesting"] = max(
-            self.analysis_result["max_nesting"], depth
-        )
+    def _traverse_tree(self, root: ASTNode) -> None:
+        """المرور على جميع عقد الشجرة (تكراري بمكدس صريح، بنفس ترتيب pre-order)"""
+        dispatch = self._DISPATCH
+        total_nodes = 0
+        max_nesting = self.analysis_result["max_nesting"]
+
+        stack = [(root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            total_nodes += 1
+            if depth > max_nesting:
+                max_nesting = depth
+
+            handler = dispatch.get(type(node))
+            if handler:
+                handler(self, node, depth)
+
+            # الاستمرار في الأطفال
+            if node.children:
+                stack.extend((child, depth + 1) for child in reversed(node.children))
 
-        if isinstance(node, LoopNode):
-            self._analyze_loop(node, depth)
-        elif isinstance(node, IfNode):
-            self._analyze_if(node, depth)
-        elif isinstance(node, PrintNode):
-            self._analyze_print(node)
-        elif isinstance(node, VariableNode):
-            self._analyze_variable(node)
-        elif isinstance(node, FunctionNode):
-            self._analyze_function(node, depth)
-
-        # الاستمرار في الأطفال
-        for child in node.children:
-            self._traverse_tree(child, depth + 1)
+        self.analysis_result["total_nodes"] += total_nodes
+        self.analysis_result["max_nesting"] = max_nesting
 
     def _analyze_loop(self, node: LoopNode, depth: int) -> None:
         """تحليل الحلقات"""
@@ -456,6 +495,7 @@ class ASTAnalyzer:
             loop_data["issues"].append("⚠️ حلقة بدون طريقة محددة للخروج")
 
         self.analysis_result["loops"].append(loop_data)
+        self._issues["loops"].extend(loop_data["issues"])
 
     def _analyze_if(self, node: IfNode, depth: int) -> None:
         """تحليل الشروط"""
@@ -477,8 +517,9 @@ class ASTAnalyzer:
             if_data["issues"].append("⚠️ كتلة if فارغة")
 
         self.analysis_result["ifs"].append(if_data)
+        self._issues["ifs"].extend(if_data["issues"])
 
-    def _analyze_print(self, node: PrintNode) -> None:
+    def _analyze_print(self, node: PrintNode, depth: int) -> None:
         """تحليل الطباعة"""
         print_data = {
             "line": node.line_number,
@@ -491,8 +532,9 @@ class ASTAnalyzer:
             print_data["issues"].append("⚠️ طباعة بدون محتوى")
 
         self.analysis_result["prints"].append(print_data)
+        self._issues["prints"].extend(print_data["issues"])
 
-    def _analyze_variable(self, node: VariableNode) -> None:
+    def _analyze_variable(self, node: VariableNode, depth: int) -> None:
         """تحليل المتغيرات"""
         var_data = {
             "line": node.line_number,
@@ -506,6 +548,7 @@ class ASTAnalyzer:
             var_data["issues"].append("❌ متغير بدون اسم")
 
         self.analysis_result["variables"].append(var_data)
+        self._issues["variables"].extend(var_data["issues"])
 
     def _analyze_function(self, node: FunctionNode, depth: int) -> None:
         """تحليل الدوال"""
@@ -526,6 +569,16 @@ class ASTAnalyzer:
             func_data["issues"].append("ℹ️ دالة تأخذ معاملات لكن لا ترجع قيمة")
 
         self.analysis_result["functions"].append(func_data)
+        self._issues["functions"].extend(func_data["issues"])
+
+    # توجيه حسب نوع العقدة (بحث في dict بدلاً من سلسلة isinstance)، مشترك بين كل النسخ
+    _DISPATCH = {
+        LoopNode: _analyze_loop,
+        IfNode: _analyze_if,
+        PrintNode: _analyze_print,
+        VariableNode: _analyze_variable,
+        FunctionNode: _analyze_function
+    }
 
     def _extract_metrics(self) -> None:
         """استخراج المقاييس"""
@@ -549,24 +602,6 @@ class ASTAnalyzer:
         complexity = 1 + loops * 2 + ifs + functions * 0.5 + nesting * 0.3
         return round(complexity, 2)
 
-    def _validate_logic(self) -> None:
-        """التحقق الدلالي من المنطق"""
-        # تجميع جميع المشاكل
-        for loop in self.analysis_result["loops"]:
-            self.analysis_result["issues"].extend(loop.get("issues", []))
-
-        for if_stmt in self.analysis_result["ifs"]:
-            self.analysis_result["issues"].extend(if_stmt.get("issues", []))
-
-        for print_stmt in self.analysis_result["prints"]:
-            self.analysis_result["issues"].extend(print_stmt.get("issues", []))
-
-        for var in self.analysis_result["variables"]:
-            self.analysis_result["issues"].extend(var.get("issues", []))
-
-        for func in self.analysis_result["functions"]:
-            self.analysis_result["issues"].extend(func.get("issues", []))
-
 
 # =====================================================
 # 5️⃣ Semantic Validator - التحقق الدلالي
@@ -585,11 +620,31 @@ class SemanticValidator:
         self.called_functions: Set[str] = set()
         self.errors: List[str] = []
         self.warnings: List[str] = []
+        # الأسماء تُجمع في قوائم أثناء المرور ثم تُضاف للمجموعات دفعة واحدة (set.update)
+        self._collected: Dict[str, List[str]] = {
+            "declared_variables": [],
+            "used_variables": [],
+            "declared_functions": [],
+            "called_functions": []
+        }
+        # نوع العقدة -> (اسم الخاصية، دالة الإضافة للقائمة المناسبة)
+        self._dispatch = {
+            VariableNode: ("var_name", self._collected["declared_variables"].append),
+            FunctionNode: ("function_name", self._collected["declared_functions"].append),
+            AssignmentNode: ("var_name", self._collected["used_variables"].append),
+            PrintNode: ("references_variable", self._collected["used_variables"].append),
+            FunctionCallNode: ("function_name", self._collected["called_functions"].append)
+        }
 
     def validate(self) -> Dict[str, Any]:
         """تنفيذ التحقق الدلالي"""
-        self._collect_declarations(self.root)
-        self._check_usages(self.root)
+        self._collect_names(self.root)
+        return self._finish()
+
+    def _finish(self) -> Dict[str, Any]:
+        """الفحوصات الدلالية وبناء النتيجة بعد جمع الأسماء"""
+        for attr, names in self._collected.items():
+            getattr(self, attr).update(names)
         self._semantic_checks()
 
         return {
@@ -602,30 +657,21 @@ class SemanticValidator:
             "called_functions": list(self.called_functions)
         }
 
-    def _collect_declarations(self, node: ASTNode) -> None:
-        """جمع جميع التعريفات (متغيرات، دوال)"""
-        if isinstance(node, VariableNode) and node.var_name:
-            self.declared_variables.add(node.var_name)
+    def _collect_names(self, root: ASTNode) -> None:
+        """جمع التعريفات (متغيرات، دوال) والاستخدامات في مرور تكراري واحد"""
+        dispatch = self._dispatch
 
-        if isinstance(node, FunctionNode) and node.function_name:
-            self.declared_functions.add(node.function_name)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            target = dispatch.get(type(node))
+            if target:
+                name = getattr(node, target[0])
+                if name:
+                    target[1](name)
 
-        for child in node.children:
-            self._collect_declarations(child)
-
-    def _check_usages(self, node: ASTNode) -> None:
-        """التحقق من استخدام المتغيرات والدوال"""
-        if isinstance(node, AssignmentNode) and node.var_name:
-            self.used_variables.add(node.var_name)
-
-        if isinstance(node, PrintNode) and node.references_variable:
-            self.used_variables.add(node.references_variable)
-
-        if isinstance(node, FunctionCallNode) and node.function_name:
-            self.called_functions.add(node.function_name)
-
-        for child in node.children:
-            self._check_usages(child)
+            if node.children:
+                stack.extend(reversed(node.children))
 
     def _semantic_checks(self) -> None:
         """فحوصات دلالية متقدمة"""
@@ -650,6 +696,58 @@ class SemanticValidator:
             self.warnings.append(f"⚠️ دالة '{func}' معرّفة لكن لم تُستدعَ")
 
 
+# =====================================================
+# 5️⃣.1 Combined Analyzer - مرور واحد للتحليل والتحقق
+# =====================================================
+class CombinedAnalyzer:
+    """
+    يدمج ASTAnalyzer و SemanticValidator في مرور واحد على الشجرة
+    بدلاً من ثلاثة مرورات منفصلة
+    """
+
+    def __init__(self, ast_root: ASTNode):
+        self.root = ast_root
+        self.analyzer = ASTAnalyzer(ast_root)
+        self.validator = SemanticValidator(ast_root)
+
+    def run(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        تنفيذ التحليل والتحقق معاً
+        Returns: (analysis, validation)
+        """
+        analyzer = self.analyzer
+        analyze_dispatch = ASTAnalyzer._DISPATCH
+        collect_dispatch = self.validator._dispatch
+        total_nodes = 0
+        max_nesting = 0
+
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            total_nodes += 1
+            if depth > max_nesting:
+                max_nesting = depth
+
+            node_cls = type(node)
+            handler = analyze_dispatch.get(node_cls)
+            if handler:
+                handler(analyzer, node, depth)
+
+            target = collect_dispatch.get(node_cls)
+            if target:
+                name = getattr(node, target[0])
+                if name:
+                    target[1](name)
+
+            if node.children:
+                stack.extend((child, depth + 1) for child in reversed(node.children))
+
+        self.analyzer.analysis_result["total_nodes"] = total_nodes
+        self.analyzer.analysis_result["max_nesting"] = max_nesting
+
+        return self.analyzer._finish(), self.validator._finish()
+
+
 # =====================================================
 # 6️⃣ Main AST Engine Class
 # =====================================================
@@ -665,6 +763,15 @@ class ASTEngine:
         self.analysis: Optional[Dict] = None
         self.validation: Optional[Dict] = None
 
+    def process_with_root(self, code_json: str) -> Tuple[Dict[str, Any], Optional[ASTNode]]:
+        """
+        مثل process لكن تُرجع أيضاً جذر الشجرة (None عند فشل التحليل)
+        حتى لا يحتاج المستدعي إلى تحليل الكود مرة ثانية لرسم الشجرة
+        """
+        self.ast_root = None
+        report = self.process(code_json)
+        return report, self.ast_root
+
     def process(self, code_json: str) -> Dict[str, Any]:
         """
         معالجة كاملة للكود من JSON إلى AST مع التحليل والتحقق
@@ -673,13 +780,8 @@ class ASTEngine:
             # 1. تحليل JSON إلى AST
             self.ast_root = self.parser.parse(code_json)
 
-            # 2. تحليل AST
-            analyzer = ASTAnalyzer(self.ast_root)
-            self.analysis = analyzer.analyze()
-
-            # 3. التحقق الدلالي
-            validator = SemanticValidator(self.ast_root)
-            self.validation = validator.validate()
+            # 2. تحليل AST + 3. التحقق الدلالي (مرور واحد)
+            self.analysis, self.validation = CombinedAnalyzer(self.ast_root).run()
 
             return self._build_report()
 
@@ -750,6 +852,33 @@ class ASTEngine:
             return "ضعيف ❌"
 
 
+# =====================================================
+# 6️⃣.1 Cached processing - نفس الكود ← نفس التقرير
+# =====================================================
+# كل مدخل في الذاكرة المؤقتة يحتفظ بالنص والشجرة والتقرير، لذا لا تُخزَّن النصوص الأكبر من هذا
+MAX_CACHED_CODE_LEN = 64 * 1024
+
+
+@lru_cache(maxsize=4096)
+def _process_cached_with_root(code_json: str) -> Tuple[Dict[str, Any], Optional[ASTNode]]:
+    return ASTEngine().process_with_root(code_json)
+
+
+def process_cached_with_root(code_json: str) -> Tuple[Dict[str, Any], Optional[ASTNode]]:
+    """
+    ASTEngine().process_with_root مع تخزين مؤقت للنتيجة حسب نص الكود
+    التقرير والشجرة مشتركان بين الطلبات، لذا يجب عدم تعديلهما
+    """
+    if len(code_json) > MAX_CACHED_CODE_LEN:
+        return ASTEngine().process_with_root(code_json)
+    return _process_cached_with_root(code_json)
+
+
+def process_cached(code_json: str) -> Dict[str, Any]:
+    """التقرير فقط من process_cached_with_root"""
+    return process_cached_with_root(code_json)[0]
+
+
 # =====================================================
 # مثال على الاستخدام
 # =====================================================
@@ -4,20 +4,80 @@
 دمج محرك AST مع تطبيق Flask الرئيسي
 """
 
-from flask import Flask, request, jsonify
-from ast_engine import ASTEngine, ASTParser, ASTAnalyzer, SemanticValidator
+from flask import Flask, current_app, request, jsonify
+from ast_engine import NodeType, MAX_CACHED_CODE_LEN, process_cached, process_cached_with_root
+from sqlalchemy import func, select, true
 from models import db, User, Challenge, Submission
+from json_provider import OrjsonProvider
+from submission_writer import save_submission
+from required_blocks import parse_required_blocks
 import json
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, FrozenSet, Tuple
 
 
 # =====================================================
 # 1️⃣ تحديث دالة التقييم بـ AST Engine
 # =====================================================
+# عدد محاولات كل (طالب، تحدي) في الذاكرة: يُقرأ من القاعدة مرة واحدة ثم يُحدَّث بعد كل حفظ
+_ATTEMPTS: Dict[Tuple[int, int], int] = {}
+
+
+def _attempt_count(student_id: int, challenge_id: int) -> int:
+    """عدد المحاولات السابقة (استعلام COUNT فقط عند أول طلب للزوج)"""
+    key = (student_id, challenge_id)
+    count = _ATTEMPTS.get(key)
+    if count is None:
+        count = _ATTEMPTS[key] = db.session.query(func.count(Submission.id)).filter_by(
+            student_id=student_id,
+            challenge_id=challenge_id
+        ).scalar()
+    return count
+
+
+def _record_attempt(student_id: int, challenge_id: int) -> None:
+    """تحديث العداد بعد حفظ محاولة جديدة (الأزواج غير المحمّلة تُقرأ من القاعدة لاحقاً)"""
+    key = (student_id, challenge_id)
+    if key in _ATTEMPTS:
+        _ATTEMPTS[key] += 1
+
+
+# نصوص التغذية الراجعة الثابتة (تُبنى مرة واحدة)
+_FB_ANALYSIS_HEADER = "📊 **تحليل AST:**"
+_FB_ERRORS_HEADER = "\n❌ **أخطاء دلالية:**"
+_FB_WARNINGS_HEADER = "\n⚠️ **تحذيرات:**"
+_FB_ALL_REQUIRED = "\n✅ **استخدمت جميع الكتل المطلوبة!**"
+_FB_ISSUES_HEADER = "\n🔍 **مشاكل تم اكتشافها:**"
+# رسالة المحاولة حسب عدد المحاولات السابقة: 0، 1، 2، 3+
+_FB_ATTEMPTS = (
+    "\n🎯 هذه أول محاولة لك! حظًا موفقًا.",
+    "\n📘 محاولة ثانية ممتازة!",
+    "\n💪 أنت تتحسن! استمر بالمحاولة.",
+    "\n🌟 إصرارك رائع! لا تستسلم.",
+)
+
+
+@lru_cache(maxsize=1024)
+def _parse_required(required_blocks: str) -> Tuple[Tuple[str, ...], FrozenSet[str]]:
+    """
+    تحليل نص الكتل المطلوبة مرة واحدة لكل قيمة
+    Returns: (الكتل بنفس الترتيب، نفس الكتل كمجموعة لفرق المجموعات)
+    """
+    required = tuple(parse_required_blocks(required_blocks))
+    return required, frozenset(required)
+
+
+def _bullets(items) -> str:
+    """قائمة نقطية في نص واحد"""
+    return "\n".join(f"  • {item}" for item in items)
+
+
 def evaluate_code_with_ast(code_json: str, required_blocks: str, challenge_type: str,
                            user=None, challenge=None) -> tuple:
     """
     دالة تقييم محسّنة تستخدم AST Engine
-    Returns: (result, feedback, ast_analysis)
+    Returns: (result, feedback, ast_analysis, ast_root)
     """
 
     feedback_parts = []
@@ -25,46 +85,42 @@ def evaluate_code_with_ast(code_json: str, required_blocks: str, challenge_type:
 
     try:
         # 1️⃣ تحليل AST
-        engine = ASTEngine()
-        ast_result = engine.process(code_json)
+        ast_result, ast_root = process_cached_with_root(code_json)
 
         if not ast_result["success"]:
-            return "fail", f"❌ خطأ في التحليل: {ast_result['error']}", None
+            return "fail", f"❌ خطأ في التحليل: {ast_result['error']}", None, None
 
         analysis = ast_result["analysis"]
         validation = ast_result["validation"]
         quality = ast_result["overall_quality"]
 
         # 2️⃣ التغذية الراجعة من التحليل
-        feedback_parts.append(f"📊 **تحليل AST:**")
-        feedback_parts.append(f"- إجمالي العقد: {analysis['total_nodes']}")
-        feedback_parts.append(f"- أقصى عمق تداخل: {analysis['max_nesting']}")
-        feedback_parts.append(f"- درجة التعقيد: {analysis['metrics']['complexity_score']}")
+        feedback_parts.append(
+            f"{_FB_ANALYSIS_HEADER}\n"
+            f"- إجمالي العقد: {analysis['total_nodes']}\n"
+            f"- أقصى عمق تداخل: {analysis['max_nesting']}\n"
+            f"- درجة التعقيد: {analysis['metrics']['complexity_score']}"
+        )
 
         # 3️⃣ التحقق الدلالي
         if validation["errors"]:
-            feedback_parts.append("\n❌ **أخطاء دلالية:**")
-            for error in validation["errors"]:
-                feedback_parts.append(f"  • {error}")
+            feedback_parts.append(_FB_ERRORS_HEADER)
+            feedback_parts.append(_bullets(validation["errors"]))
 
         if validation["warnings"]:
-            feedback_parts.append("\n⚠️ **تحذيرات:**")
-            for warning in validation["warnings"]:
-                feedback_parts.append(f"  • {warning}")
+            feedback_parts.append(_FB_WARNINGS_HEADER)
+            feedback_parts.append(_bullets(validation["warnings"]))
 
         # 4️⃣ التحقق من المكونات المطلوبة
-        if required_blocks:
-            required = [b.strip() for b in required_blocks.split(",")]
-
-            # حساب الكتل المستخدمة من AST
-            used_blocks = set()
-            _collect_block_types(analysis, used_blocks)
-
-            missing = [r for r in required if r not in used_blocks]
-            if missing:
+        required, required_set = _parse_required(required_blocks or "")
+        if required:
+            # الكتل الناقصة = المطلوبة - المستخدمة (فرق مجموعات)، ثم بترتيب التحدي للعرض
+            missing_set = required_set.difference(analysis["block_types"])
+            if missing_set:
+                missing = [r for r in required if r in missing_set]
                 feedback_parts.append(f"\n⚠️ **كتل ناقصة:** {', '.join(missing)}")
             else:
-                feedback_parts.append(f"\n✅ **استخدمت جميع الكتل المطلوبة!**")
+                feedback_parts.append(_FB_ALL_REQUIRED)
                 result = "success"
 
         # 5️⃣ جودة الكود
@@ -74,25 +130,13 @@ def evaluate_code_with_ast(code_json: str, required_blocks: str, challenge_type:
 
         # 6️⃣ المشاكل المحددة
         if analysis["issues"]:
-            feedback_parts.append("\n🔍 **مشاكل تم اكتشافها:**")
-            for issue in analysis["issues"][:5]:  # أول 5 مشاكل
-                feedback_parts.append(f"  • {issue}")
+            feedback_parts.append(_FB_ISSUES_HEADER)
+            feedback_parts.append(_bullets(analysis["issues"][:5]))  # أول 5 مشاكل
 
         # 7️⃣ محاولات الطالب السابقة
         if user and challenge:
-            attempt_count = Submission.query.filter_by(
-                student_id=user.id,
-                challenge_id=challenge.id
-            ).count()
-
-            if attempt_count == 0:
-                feedback_parts.append("\n🎯 هذه أول محاولة لك! حظًا موفقًا.")
-            elif attempt_count == 1:
-                feedback_parts.append("\n📘 محاولة ثانية ممتازة!")
-            elif attempt_count == 2:
-                feedback_parts.append("\n💪 أنت تتحسن! استمر بالمحاولة.")
-            else:
-                feedback_parts.append("\n🌟 إصرارك رائع! لا تستسلم.")
+            attempt_count = _attempt_count(user.id, challenge.id)
+            feedback_parts.append(_FB_ATTEMPTS[min(attempt_count, len(_FB_ATTEMPTS) - 1)])
 
         # تحديد النتيجة النهائية
         if validation["errors"]:
@@ -102,24 +146,19 @@ def evaluate_code_with_ast(code_json: str, required_blocks: str, challenge_type:
 
         feedback_text = "\n".join(feedback_parts)
 
-        return result, feedback_text, ast_result
+        return result, feedback_text, ast_result, ast_root
 
     except Exception as e:
-        return "fail", f"❌ خطأ أثناء التقييم: {str(e)}", None
+        return "fail", f"❌ خطأ أثناء التقييم: {str(e)}", None, None
 
 
-def _collect_block_types(analysis: dict, block_set: set) -> None:
-    """استخراج أنواع الكتل من التحليل"""
-    if "loops" in analysis and analysis["loops"]:
-        block_set.add("loop")
-    if "ifs" in analysis and analysis["ifs"]:
-        block_set.add("if")
-    if "prints" in analysis and analysis["prints"]:
-        block_set.add("print")
-    if "variables" in analysis and analysis["variables"]:
-        block_set.add("variable")
-    if "functions" in analysis and analysis["functions"]:
-        block_set.add("function")
+def _fetch_user_and_challenge(username, challenge_id):
+    """جلب المستخدم والتحدي في استعلام واحد؛ None إذا لم يوجد أحدهما"""
+    return db.session.execute(
+        select(User, Challenge)
+        .join_from(User, Challenge, true())  # كلا الطرفين مقيّد بصف واحد
+        .where(User.username == username, Challenge.id == challenge_id)
+    ).first()
 
 
 # =====================================================
@@ -129,6 +168,10 @@ def _collect_block_types(analysis: dict, block_set: set) -> None:
 def register_ast_routes(app: Flask):
     """تسجيل مسارات AST مع التطبيق"""
 
+    # مسارات AST ترسل وتستقبل أشجار JSON كبيرة؛ orjson أسرع بكثير من json القياسي
+    if not isinstance(app.json, OrjsonProvider):
+        app.json = OrjsonProvider(app)
+
     # =====================================================
     # AST Analysis Endpoint
     # =====================================================
@@ -151,8 +194,7 @@ def register_ast_routes(app: Flask):
             return jsonify({'error': 'كود JSON مطلوب'}), 400
 
         try:
-            engine = ASTEngine()
-            result = engine.process(code_json)
+            result = process_cached(code_json)
 
             return jsonify({
                 'success': True,
@@ -189,11 +231,10 @@ def register_ast_routes(app: Flask):
             return jsonify({'error': 'كود JSON مطلوب'}), 400
 
         try:
-            parser = ASTParser()
-            ast_root = parser.parse(code_json)
-
-            validator = SemanticValidator(ast_root)
-            validation_result = validator.validate()
+            ast_result = process_cached(code_json)
+            if not ast_result['success']:
+                raise ValueError(ast_result['error'])
+            validation_result = ast_result['validation']
 
             return jsonify({
                 'success': True,
@@ -227,8 +268,7 @@ def register_ast_routes(app: Flask):
             return jsonify({'error': 'كود JSON مطلوب'}), 400
 
         try:
-            engine = ASTEngine()
-            result = engine.process(code_json)
+            result = process_cached(code_json)
 
             metrics = result['analysis']['metrics']
             quality = result['overall_quality']
@@ -270,33 +310,31 @@ def register_ast_routes(app: Flask):
         challenge_id = data.get('challenge_id')
         code_json = data.get('code_json')
 
-        user = User.query.filter_by(username=username).first()
-        if not user:
-            return jsonify({'error': 'المستخدم غير موجود'}), 404
-
-        challenge = Challenge.query.get(challenge_id)
-        if not challenge:
+        row = _fetch_user_and_challenge(username, challenge_id)
+        if row is None:
+            if db.session.query(User.id).filter_by(username=username).first() is None:
+                return jsonify({'error': 'المستخدم غير موجود'}), 404
             return jsonify({'error': 'التحدي غير موجود'}), 404
+        user, challenge = row
 
         # استدعاء التقييم مع AST
-        result, feedback, ast_analysis = evaluate_code_with_ast(
+        result, feedback, ast_analysis, ast_root = evaluate_code_with_ast(
             code_json,
             challenge.required_blocks,
-            challenge.challenge_type,
+            challenge.concept,
             user=user,
             challenge=challenge
         )
 
-        # حفظ النتيجة
-        submission = Submission(
-            student_id=user.id,
-            challenge_id=challenge.id,
-            code_json=code_json,
-            result=result,
-            feedback_text=feedback
-        )
-        db.session.add(submission)
-        db.session.commit()
+        # حفظ النتيجة (عبر الطابور الخلفي إذا كان مفعّلاً)
+        save_submission(current_app, {
+            'student_id': user.id,
+            'challenge_id': challenge.id,
+            'code_json': code_json,
+            'result': result,
+            'feedback_text': feedback
+        })
+        _record_attempt(user.id, challenge.id)
 
         response_data = {
             'message': 'تم حفظ المحاولة بنجاح! ✅',
@@ -317,6 +355,10 @@ def register_ast_routes(app: Flask):
                 'warnings': len(ast_analysis['validation']['warnings'])
             }
 
+        # الشجرة من نفس التحليل ومن نفس ذاكرة /ast/tree (لا تحليل ولا تحويل مكرر)
+        if data.get('include_tree') and ast_root is not None:
+            response_data['ast_tree'] = _ast_tree_cached(code_json, ast_root)
+
         return jsonify(response_data), 201
 
     # =====================================================
@@ -334,10 +376,7 @@ def register_ast_routes(app: Flask):
             return jsonify({'error': 'كود JSON مطلوب'}), 400
 
         try:
-            parser = ASTParser()
-            ast_root = parser.parse(code_json)
-
-            tree_json = _convert_ast_to_json(ast_root)
+            tree_json = _ast_tree_cached(code_json)
 
             return jsonify({
                 'success': True,
@@ -351,26 +390,62 @@ def register_ast_routes(app: Flask):
             }), 400
 
 
-def _convert_ast_to_json(node) -> dict:
-    """تحويل عقدة AST إلى JSON للتصور"""
+def _ast_tree(code_json: str) -> dict:
+    """شجرة AST بصيغة JSON"""
+    ast_result, ast_root = process_cached_with_root(code_json)
+    if ast_root is None:
+        raise ValueError(ast_result["error"])
+    return _convert_ast_to_json(ast_root)
+
+
+_ast_tree_lru = lru_cache(maxsize=4096)(_ast_tree)
+
+
+def _ast_tree_cached(code_json: str, ast_root=None) -> dict:
+    """
+    شجرة AST مع تخزين مؤقت حسب نص الكود، ما عدا النصوص الكبيرة (لا تعدّل النتيجة)
+    ast_root: الشجرة إن كانت محللة مسبقاً، حتى لا يُعاد تحليل النصوص الكبيرة
+    """
+    if len(code_json) > MAX_CACHED_CODE_LEN:
+        if ast_root is not None:
+            return _convert_ast_to_json(ast_root)
+        return _ast_tree(code_json)
+    return _ast_tree_lru(code_json)
+
+
+def _node_to_json(node) -> dict:
+    """عقدة واحدة بصيغة JSON (الأطفال تُضاف لاحقاً)"""
+    node_type = node.node_type
     return {
-        'type': node.node_type.value if hasattr(node.node_type, 'value') else str(node.node_type),
+        'type': node_type.value if isinstance(node_type, NodeType) else str(node_type),
         'line': node.line_number,
         'metadata': node.metadata,
-        'children': [_convert_ast_to_json(child) for child in node.children]
+        'children': []
     }
 
 
+def _convert_ast_to_json(root) -> dict:
+    """تحويل شجرة AST إلى JSON للتصور (تكراري بمكدس صريح بدلاً من recursion)"""
+    tree = _node_to_json(root)
+    stack = [(root, tree['children'])]
+    while stack:
+        node, out = stack.pop()
+        for child in node.children:
+            child_json = _node_to_json(child)
+            out.append(child_json)
+            if child.children:
+                stack.append((child, child_json['children']))
+    return tree
+
+
+# الحد الأعلى (شامل) لكل مستوى تعقيد
+_COMPLEXITY_THRESHOLDS = (3, 6, 10, float('inf'))
+_COMPLEXITY_LABELS = ("بسيط جداً 🟢", "متوسط 🟡", "معقد 🟠", "معقد جداً 🔴")
+
+
 def _get_complexity_level(score: float) -> str:
     """تحديد مستوى التعقيد"""
-    if score <= 3:
-        return "بسيط جداً 🟢"
-    elif score <= 6:
-        return "متوسط 🟡"
-    elif score <= 10:
-        return "معقد 🟠"
-    else:
-        return "معقد جداً 🔴"
+    return _COMPLEXITY_LABELS[bisect_left(_COMPLEXITY_THRESHOLDS, score)]
 
 
 # =====================================================
@@ -379,10 +454,6 @@ def _get_complexity_level(score: float) -> str:
 def update_submit_route(app: Flask):
     """تحديث مسار التقديم ليستخدم AST"""
 
-    # احفظ المسار القديم
-    original_submit = app.view_functions.get('submit')
-
-    @app.route('/submit', methods=['POST'])
     def submit_updated():
         """مسار التقديم المحدّث مع AST Engine"""
         data = request.get_json()
@@ -391,20 +462,19 @@ def update_submit_route(app: Flask):
         code_json = data.get('code_json')
         use_ast = data.get('use_ast', True)  # استخدام AST افتراضياً
 
-        user = User.query.filter_by(username=username).first()
-        if not user:
-            return jsonify({'error': 'المستخدم غير موجود'}), 404
-
-        challenge = Challenge.query.get(challenge_id)
-        if not challenge:
+        row = _fetch_user_and_challenge(username, challenge_id)
+        if row is None:
+            if db.session.query(User.id).filter_by(username=username).first() is None:
+                return jsonify({'error': 'المستخدم غير موجود'}), 404
             return jsonify({'error': 'التحدي غير موجود'}), 404
+        user, challenge = row
 
         # استخدام AST إذا طُلب ذلك
         if use_ast:
-            result, feedback, ast_analysis = evaluate_code_with_ast(
+            result, feedback, ast_analysis, ast_root = evaluate_code_with_ast(
                 code_json,
                 challenge.required_blocks,
-                challenge.challenge_type,
+                challenge.concept,
                 user=user,
                 challenge=challenge
             )
@@ -414,22 +484,20 @@ def update_submit_route(app: Flask):
             result, feedback = evaluate_code(
                 code_json,
                 challenge.required_blocks,
-                challenge.challenge_type,
                 user=user,
                 challenge=challenge
             )
-            ast_analysis = None
-
-        # حفظ النتيجة
-        submission = Submission(
-            student_id=user.id,
-            challenge_id=challenge.id,
-            code_json=code_json,
-            result=result,
-            feedback_text=feedback
-        )
-        db.session.add(submission)
-        db.session.commit()
+            ast_analysis = ast_root = None
+
+        # حفظ النتيجة (عبر الطابور الخلفي إذا كان مفعّلاً)
+        save_submission(current_app, {
+            'student_id': user.id,
+            'challenge_id': challenge.id,
+            'code_json': code_json,
+            'result': result,
+            'feedback_text': feedback
+        })
+        _record_attempt(user.id, challenge.id)
 
         response = {
             'message': 'تم حفظ المحاولة بنجاح! ✅',
@@ -447,8 +515,18 @@ def update_submit_route(app: Flask):
                 'grade': ast_analysis['overall_quality']['grade']
             }
 
+        if data.get('include_tree') and ast_root is not None:
+            response['ast_tree'] = _ast_tree_cached(code_json, ast_root)
+
         return jsonify(response), 201
 
+    # استبدال دالة endpoint 'submit' بدلاً من إضافة قاعدة /submit ثانية:
+    # القاعدة المكررة لا تُستخدم أبداً (الأولى تطابق أولاً) وتبطئ مطابقة العناوين
+    if 'submit' in app.view_functions:
+        app.view_functions['submit'] = submit_updated
+    else:
+        app.add_url_rule('/submit', 'submit', submit_updated, methods=['POST'])
+
 
 # =====================================================
 # 4️⃣ مثال على كيفية استخدام في app.py
@@ -0,0 +1,46 @@
+"""
+⚡ Fast JSON Provider - orjson لـ Flask
+======================================
+استبدال مُرمِّز JSON الافتراضي في Flask بـ orjson
+لتسريع jsonify و request.get_json
+"""
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    مزوّد JSON يعتمد على orjson
+    يحافظ على ترتيب المفاتيح مثل المزوّد الافتراضي (sort_keys)
+    """
+
+    # OPT_NAIVE_UTC: التواريخ بدون منطقة زمنية تُعامل كـ UTC
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS | orjson.OPT_NAIVE_UTC
+
+    def dumps(self, obj, **kwargs) -> str:
+        """تحويل كائن إلى نص JSON"""
+        try:
+            return orjson.dumps(obj, default=self.default, option=self.option).decode()
+        except orjson.JSONEncodeError:
+            # orjson يرفض التداخل الأعمق من 254 مستوى (مثل أشجار AST العميقة)
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        """تحويل نص/بايتات JSON إلى كائن"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """بناء Response مباشرة من البايتات دون decode/encode إضافي"""
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.option | orjson.OPT_APPEND_NEWLINE
+
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+
+        try:
+            body = orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -32,6 +32,11 @@ class Challenge(db.Model):
 
     test_cases = db.relationship('TestCase', backref='challenge', lazy=True, cascade='all, delete-orphan')
     solution_templates = db.relationship('SolutionTemplate', backref='challenge', lazy=True, cascade='all, delete-orphan')
+    required_block_rows = db.relationship('ChallengeRequiredBlock', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_challenge_title', 'title'),
+    )
 
     def __repr__(self):
         return f"<Challenge {self.title} ({self.difficulty})>"
@@ -46,6 +51,14 @@ class Submission(db.Model):
     result = db.Column(db.String(20))  # success / fail
     feedback_text = db.Column(db.Text)
 
+    # Attempt counter in evaluate_code filters on both columns;
+    # teacher_list_submissions reads the latest rows per challenge / per student.
+    __table_args__ = (
+        db.Index('ix_submission_student_challenge', 'student_id', 'challenge_id'),
+        db.Index('ix_sub_challenge_id_id_desc', challenge_id, id.desc()),
+        db.Index('ix_sub_student_id_id_desc', student_id, id.desc()),
+    )
+
     def __repr__(self):
         return f"<Submission student={self.student_id} challenge={self.challenge_id} result={self.result}>"
 
@@ -76,3 +89,18 @@ class SolutionTemplate(db.Model):
 
     def __repr__(self):
         return f"<SolutionTemplate challenge={self.challenge_id} name={self.name}>"
+
+
+# ==============================
+# Challenge Required Block Model
+# ==============================
+class ChallengeRequiredBlock(db.Model):
+    # Parsed form of Challenge.required_blocks, written once when the challenge is saved.
+    # position keeps the declared order (and repeated names); the composite primary key
+    # also serves lookups by challenge_id.
+    challenge_id = db.Column(db.Integer, db.ForeignKey('challenge.id'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    block_name = db.Column(db.String(80), nullable=False)
+
+    def __repr__(self):
+        return f"<ChallengeRequiredBlock challenge={self.challenge_id} block={self.block_name}>"
@@ -0,0 +1,26 @@
+"""
+🧩 Required Blocks - تحليل الكتل المطلوبة للتحدي
+===============================================
+قراءة Challenge.required_blocks بنفس الطريقة في مسار التقييم العادي ومسار AST
+(مصفوفة JSON أو نص مفصول بفواصل)
+"""
+
+import json
+
+
+def parse_required_blocks(required_blocks):
+    """Block names from a list, a JSON array string, or a comma-separated string."""
+    if not required_blocks:
+        return []
+    names = required_blocks
+    if not isinstance(names, list):
+        text = names.strip()
+        names = None
+        if text.startswith('['):
+            try:
+                names = json.loads(text)
+            except ValueError:
+                names = None
+        if not isinstance(names, list):
+            names = text.split(',')
+    return [str(n).strip() for n in names if str(n).strip()]
@@ -1,9 +1,19 @@
-async function requestJson(path, { method = 'GET', body } = {}) {
-  const res = await fetch(path, {
-    method,
-    headers: { 'Content-Type': 'application/json' },
-    body: body ? JSON.stringify(body) : undefined,
-  });
+// Responses revalidated with ETag / If-None-Match: cacheKey -> { etag, data }
+const etagCache = new Map();
+
+async function requestJson(path, { method = 'GET', body, revalidate = false } = {}) {
+  const payload = body ? JSON.stringify(body) : undefined;
+  const cacheKey = revalidate ? `${method} ${path} ${payload || ''}` : null;
+  const cached = cacheKey ? etagCache.get(cacheKey) : null;
+
+  const headers = { 'Content-Type': 'application/json' };
+  if (cached) headers['If-None-Match'] = cached.etag;
+
+  const res = await fetch(path, { method, headers, body: payload });
+
+  if (res.status === 304 && cached) {
+    return cached.data;
+  }
 
   const text = await res.text();
   let data;
@@ -21,6 +31,11 @@ async function requestJson(path, { method = 'GET', body } = {}) {
     throw err;
   }
 
+  const etag = res.headers.get('ETag');
+  if (cacheKey && etag) {
+    etagCache.set(cacheKey, { etag, data });
+  }
+
   return data;
 }
 
@@ -35,7 +50,8 @@ export const api = {
   submit: (payload) => requestJson('/submit', { method: 'POST', body: payload }),
   getSubmissions: (username) => requestJson(`/submissions/${encodeURIComponent(username)}`),
 
-  teacherListSubmissions: (payload) => requestJson('/teacher/submissions', { method: 'POST', body: payload }),
+  teacherListSubmissions: (payload) =>
+    requestJson('/teacher/submissions', { method: 'POST', body: payload, revalidate: true }),
   teacherUpdateSubmission: (submissionId, payload) =>
     requestJson(`/teacher/submissions/${encodeURIComponent(submissionId)}`, { method: 'PUT', body: payload }),
 
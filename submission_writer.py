@@ -0,0 +1,158 @@
+"""
+📝 Submission Writer - كتابة التقديمات على دفعات
+================================================
+طابور في الذاكرة + خيط خلفي يكتب التقديمات إلى القاعدة
+كل 50ms أو كل 32 صف، بعملية commit واحدة لكل دفعة
+(اختياري: يُفعَّل عبر SUBMIT_BATCH_WRITES)
+عند امتلاء الطابور تُكتب التقديمات مباشرة في الطلب نفسه
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from models import db, Submission
+
+
+class SubmissionWriter:
+    """
+    كاتب التقديمات المؤجل
+    المسارات تضيف صفوفاً (dict) إلى الطابور وتعيد الاستجابة فوراً
+    """
+
+    def __init__(self, app=None, batch_size: int = 32, interval: float = 0.05,
+                 max_pending: int = 1000, max_retries: int = 5, max_backoff: float = 5.0):
+        self.app = None
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._failures = 0  # محاولات فاشلة متتالية للدفعة في رأس الطابور
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # الخيط الخلفي و atexit قد يفرّغان الطابور معاً
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """ربط الكاتب بالتطبيق"""
+        self.app = app
+        app.config.setdefault('SUBMIT_BATCH_WRITES', bool(os.environ.get('SUBMIT_BATCH_WRITES')))
+        app.extensions['submission_writer'] = self
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.app and self.app.config.get('SUBMIT_BATCH_WRITES'))
+
+    def queue(self, row: dict) -> bool:
+        """
+        إضافة تقديم إلى الطابور (يبدأ الخيط الخلفي عند أول استخدام)
+        Returns: False إذا كان الطابور ممتلئاً، وعلى المستدعي كتابة الصف بنفسه
+        """
+        if len(self._pending) >= self.max_pending:
+            return False
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+                    atexit.register(self._flush_at_exit)
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self) -> int:
+        """
+        كتابة كل التقديمات المنتظرة (INSERT واحد متعدد الصفوف لكل دفعة)
+        Returns: عدد الصفوف التي بقيت في الطابور
+        """
+        with self._flush_lock:
+            pending = self._pending
+            while pending:
+                batch = []
+                while pending and len(batch) < self.batch_size:
+                    batch.append(pending.popleft())
+                retry = self._write(batch)
+                if not retry:
+                    if self._failures:
+                        print(f'[submission_writer] recovered after {self._failures} failed attempts')
+                    self._failures = 0
+                    continue
+                self._failures += 1
+                if self._failures > self.max_retries:
+                    print(f'[submission_writer] dropped {len(retry)} submissions after {self.max_retries} retries')
+                    self._failures = 0
+                    continue
+                # خطأ مؤقت: نعيد الصفوف إلى رأس الطابور ونحاول بعد مهلة
+                pending.extendleft(reversed(retry))
+                break
+            return len(pending)
+
+    def _write(self, batch: list) -> list:
+        """
+        كتابة دفعة واحدة
+        Returns: الصفوف التي فشلت بخطأ مؤقت (مثل database is locked) لإعادة المحاولة
+        """
+        import traceback
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(Submission), batch)
+                db.session.commit()
+                return []
+            except OperationalError:
+                db.session.rollback()
+                if not self._failures:  # سجل واحد لكل سلسلة فشل
+                    traceback.print_exc()
+                return batch
+            except Exception:
+                db.session.rollback()
+
+            # صف غير صالح أفشل الدفعة: نكتب الصفوف واحداً واحداً حتى لا تُفقد البقية
+            retry = []
+            for row in batch:
+                try:
+                    db.session.execute(insert(Submission), [row])
+                    db.session.commit()
+                except OperationalError:
+                    db.session.rollback()
+                    retry.append(row)
+                except Exception:
+                    db.session.rollback()
+                    traceback.print_exc()
+            return retry
+
+    def _run(self) -> None:
+        while True:
+            if self._failures:
+                # تراجع أُسّي بعد الفشل، دون أن يقطعه امتلاء الدفعة
+                time.sleep(min(self.interval * 2 ** self._failures, self.max_backoff))
+            else:
+                self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _flush_at_exit(self) -> None:
+        left = self.flush()
+        if left:
+            print(f'[submission_writer] exiting with {left} unsaved submissions (dropped)')
+
+
+def save_submission(app, row: dict) -> None:
+    """
+    حفظ تقديم: عبر الطابور إذا كان الكاتب مفعّلاً وغير ممتلئ، وإلا commit مباشر
+    (أي خطأ في الكتابة المباشرة يظهر في الطلب نفسه)
+    """
+    writer = app.extensions.get('submission_writer')
+    if writer is not None and writer.enabled and writer.queue(row):
+        return
+    db.session.add(Submission(**row))
+    db.session.commit()